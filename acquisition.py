@@ -0,0 +1,235 @@
+import datetime
+import queue
+import threading
+import time
+import db_functions
+import debug_functions as debugf
+from wire_reader import read_1wire_sensors, SensorRegistry
+
+class SampleScheduler:
+    def __init__(self, interval, missed_policy="skip"):
+        """
+        Fixed-rate scheduler based on time.monotonic() deadlines.
+
+        Sample instants are anchored to the start time (aligned to a whole multiple of the
+        interval on the wall clock), so the time spent reading and storing a sample does not
+        shift the following ones. When a tick runs longer than a whole interval, "skip" drops
+        the missed instants and "catch_up" runs them back to back.
+        """
+        self.interval = interval  # in seconds
+        self.missed_policy = missed_policy
+        self.next_deadline = None
+        self._anchor_mono = None
+        self._anchor_wall = None
+        self._catching_up = False  # a catch_up backlog is reported once, not on every tick of it
+
+        # Statistics
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+
+    def set_interval(self, interval):
+        # A new interval starts a new series of sample instants
+        if interval != self.interval:
+            self.interval = interval
+            self.next_deadline = None
+
+    def _anchor(self):
+        now_mono = time.monotonic()
+        now_wall = time.time()
+        self._anchor_mono = now_mono
+        self._anchor_wall = now_wall
+        self.next_deadline = now_mono + (self.interval - now_wall % self.interval)
+
+    def wall_time(self, deadline):
+        # Wall clock time of a monotonic deadline, re-anchored when the system clock was stepped
+        offset = time.time() - time.monotonic()
+        if abs(offset - (self._anchor_wall - self._anchor_mono)) > 1.0:
+            self._anchor_wall = self._anchor_mono + offset
+        # Rounded so float error cannot move an aligned instant into the previous second
+        return round(self._anchor_wall + (deadline - self._anchor_mono), 3)
+
+    def wait(self, stop_event):
+        # Blocks until the next sample instant and returns its wall clock time, None when stopped
+        if self.next_deadline is None:
+            self._anchor()
+
+        late = time.monotonic() - self.next_deadline
+        if late > 0 and self.ticks:
+            # The previous tick finished after this deadline (with catch_up, also every tick of the backlog)
+            self.overruns += 1
+            missed = int(late // self.interval)
+            if missed and self.missed_policy == "skip":
+                self.skipped += missed
+                self.next_deadline += missed * self.interval
+                print(f"Sampling overrun, skipped {missed} sample(s)")
+            elif missed and not self._catching_up:
+                print(f"Sampling overrun, catching up {missed} sample(s)")
+            self._catching_up = missed > 0 and self.missed_policy == "catch_up"
+        else:
+            self._catching_up = False
+            if late < 0 and stop_event.wait(-late):
+                return None
+        if stop_event.is_set():
+            return None
+
+        deadline = self.next_deadline
+        self.last_jitter = max(time.monotonic() - deadline, 0.0)
+        self.max_jitter = max(self.max_jitter, self.last_jitter)
+        self.ticks += 1
+        self.next_deadline = deadline + self.interval
+        return self.wall_time(deadline)
+
+    def summary(self):
+        # One line for the status bar and the logger
+        return (f"{self.ticks} samples, {self.overruns} overruns, {self.skipped} skipped, "
+                f"jitter {self.last_jitter * 1000:.0f} ms (max {self.max_jitter * 1000:.0f} ms)")
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "last_jitter": self.last_jitter,
+            "max_jitter": self.max_jitter
+        }
+
+class AcquisitionEngine:
+    def __init__(self, config, registry=None, max_queued=1000):
+        """
+        Sample the sensors in a background thread.
+
+        Every sample is written to the database (while recording) by the engine thread and
+        published as a (timestamp, [t1, t2, t3]) tuple on the `samples` queue, so the UI only
+        has to drain the queue and render. `config` is read on every tick, changes made in
+        the config window apply without a restart.
+        """
+        self.config = config
+        self.db_path = config.get("db_path")
+        self.table_name = config.get("table_name")
+
+        # Sensor discovery is cached, each 1-Wire id keeps its channel
+        if registry is None:
+            registry = SensorRegistry(
+                channels=3,
+                rescan_interval=config.get("sensor_rescan_interval"),
+                map_file=config.get("sensor_map_path")
+            )
+        self.sensor_registry = registry
+
+        # Bounded so a stalled UI cannot grow memory forever, the oldest samples are dropped first
+        self.samples = queue.Queue(maxsize=max_queued)
+
+        # Toggled from the UI, read by the engine thread
+        self.recording = False
+
+        # Samples are committed in batches, not one transaction per tick
+        self._invalid_partition_by = None  # last rejected partition_by value, reported once
+        self.writer = db_functions.BufferedWriter(
+            self.db_path,
+            self.table_name,
+            config.get("write_batch_size"),
+            config.get("write_flush_interval")
+        )
+        self.writer.partition_by = self.partition_by()
+
+        # Sample instants follow monotonic deadlines, the time spent in a tick does not add drift
+        self.scheduler = SampleScheduler(
+            config.get("update_interval") / 1000,
+            config.get("missed_tick_policy")
+        )
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="acquisition", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        # Stops sampling and writes the samples still in the buffer
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.writer.flush()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            self.scheduler.set_interval(self.config.get("update_interval") / 1000)
+            self.scheduler.missed_policy = self.config.get("missed_tick_policy")
+            scheduled = self.scheduler.wait(self._stop_event)
+            if scheduled is None:
+                break
+            try:
+                self.tick(scheduled)
+            except Exception as e:
+                print(f"Acquisition error: {e}")
+
+    def tick(self, scheduled=None):
+        data_time, temps = self.read_sample(scheduled)
+        self.writer.batch_size = self.config.get("write_batch_size")
+        self.writer.flush_interval = self.config.get("write_flush_interval")
+        self.writer.partition_by = self.partition_by()
+        if self.recording:
+            self.writer.add(data_time, *temps)
+        elif self.writer.pending():
+            # Recording was switched off, write what is left
+            self.writer.flush()
+        self.publish((data_time, temps))
+
+    def partition_by(self):
+        # partition_by is free text in the config window, an unknown value keeps the current layout
+        value = self.config.get("partition_by")
+        if value in db_functions.PARTITION_BY_VALUES:
+            return value
+        fallback = self.writer.partition_by
+        if value != self._invalid_partition_by:
+            self._invalid_partition_by = value
+            print(f"Unknown partition_by value {value!r}, use one of {', '.join(db_functions.PARTITION_BY_VALUES)}; keeping {fallback!r}")
+        return fallback
+
+    def read_sample(self, scheduled=None):
+        # Samples are stamped with their scheduled instant, not with the time the read finished
+        if scheduled is None:
+            scheduled = time.time()
+        data_time = datetime.datetime.fromtimestamp(scheduled).strftime("%Y-%m-%d %H:%M:%S")
+
+        if self.config.get("debug_mode"):
+            temps = [debugf.random_temp() for _ in range(3)]
+        else:
+            temps = read_1wire_sensors(
+                self.config.get("read_mode"),
+                self.config.get("sensor_timeout") / 1000,
+                self.sensor_registry,
+                self.config.get("sensor_max_attempts")
+            )
+        return data_time, temps
+
+    def publish(self, sample):
+        while True:
+            try:
+                self.samples.put_nowait(sample)
+                return
+            except queue.Full:
+                try:
+                    self.samples.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def drain(self):
+        # Every sample published since the last call, oldest first
+        samples = []
+        while True:
+            try:
+                samples.append(self.samples.get_nowait())
+            except queue.Empty:
+                return samples
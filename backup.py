@@ -0,0 +1,111 @@
+import datetime
+import threading
+import db_functions
+
+class BackupScheduler:
+    def __init__(self, config):
+        """
+        Run online backups in a background thread, daily at "backup_time" ("HH:MM", empty
+        disables the schedule) and on demand with run_now(). Backups go to "backup_path",
+        the newest "backup_keep" are kept. The logger keeps running during a backup.
+
+        The same thread applies the partition retention ("archive_after_days") when it starts
+        and then once a day, so an app or logger running for months keeps archiving.
+        """
+        self.config = config
+        self.running = False
+        self.last_backup = None  # folder of the last finished backup
+        self.last_error = None
+        self.progress = 0.0  # fraction of the current file copied
+        self.archived_on = None  # date of the last archive_partitions run
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._backup_requested = threading.Event()  # set by run_now(), also wakes the thread up
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="backup_schedule", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        self._backup_requested.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        # The schedule is checked every 30 s, changes in the config window apply without a restart.
+        # Backups asked for with run_now() run here too, every backup uses this thread's connections.
+        while not self._stop_event.is_set():
+            try:
+                if self.archive_due():
+                    self.run_archive()
+                if self._backup_requested.is_set() or self.due():
+                    self._backup_requested.clear()
+                    self.run_backup()
+            except Exception as e:
+                print(f"Backup schedule error: {e}")
+            self._backup_requested.wait(30)
+
+    def archive_due(self, today=None):
+        return bool(self.config.get("archive_after_days")) and self.archived_on != (today or datetime.date.today())
+
+    def run_archive(self):
+        self.archived_on = datetime.date.today()
+        db_functions.archive_partitions(
+            self.config.get("db_path"),
+            self.config.get("table_name"),
+            self.config.get("archive_path"),
+            self.config.get("archive_after_days")
+        )
+
+    def due(self, now=None):
+        # True once the scheduled time of today has passed and no backup was made since
+        backup_time = self.config.get("backup_time")
+        if not backup_time or self.running:
+            return False
+        now = now or datetime.datetime.now()
+        hour, minute = (int(part) for part in backup_time.split(":"))
+        scheduled = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if now < scheduled:
+            return False
+        backups = db_functions.list_backups(self.config.get("backup_path"))
+        return not backups or backups[-1][0] < scheduled
+
+    def run_now(self):
+        # Hands a backup to the scheduler thread, False when one is already running or asked for
+        if self.running or self._backup_requested.is_set():
+            return False
+        self.start()
+        self._backup_requested.set()
+        return True
+
+    def run_backup(self):
+        with self._lock:
+            if self.running:
+                return None
+            self.running = True
+        self.progress = 0.0
+        try:
+            self.last_backup = db_functions.backup_db(
+                self.config.get("db_path"),
+                self.config.get("table_name"),
+                self.config.get("backup_path"),
+                progress=self.report_progress
+            )
+            self.last_error = None
+            db_functions.prune_backups(self.config.get("backup_path"), self.config.get("backup_keep"))
+            return self.last_backup
+        except Exception as e:
+            self.last_error = e
+            print(f"Backup failed: {e}")
+            return None
+        finally:
+            self.running = False
+
+    def report_progress(self, copied, total, path):
+        self.progress = copied / total if total else 1.0
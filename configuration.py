@@ -5,22 +5,14 @@ from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
 import db_functions
-import sqlite3
+from settings import CONFIG_FILE, DEFAULT_CONFIG
 
 class Config:
     def __init__(self, master):
         self.master = master
-        self.config_file = "config.json"
-        # !!! IMPORTANT: the original_default_config is the DEFAULTS set when the config file does not exist. These are enforced when reseting the config. Do not change these values without a deep understanding of the application's behavior.
-        self.original_default_config = {
-            "db_path": "sensor_database.db",
-            "export_path": ".\database_dump.csv",
-            "temperature_range": [0, 50],
-            "table_name": "temps",
-            "update_interval": 5000,  # in milliseconds
-            "graph_points": 60,
-            "debug_mode": False # !!! IMPORTANT: Debug mode should be False in a production environment!
-        }
+        self.config_file = CONFIG_FILE
+        # !!! IMPORTANT: see DEFAULT_CONFIG in settings.py
+        self.original_default_config = DEFAULT_CONFIG.copy()
         self.default_config = self.original_default_config.copy()
         self.load_config()
         self.ensure_database_setup()
@@ -39,22 +31,24 @@ class Config:
         table_name = self.get("table_name")
         if not os.path.exists(db_path):
             if messagebox.askyesno("Database Not Found", f"The database file '{db_path}' does not exist. Would you like to create it?"):
-                db_functions.create_db(db_path, table_name)
+                db_functions.create_db(db_path, table_name, self.get("timestamp_storage"))
                 messagebox.showinfo("Success", f"Database created at {db_path}")
             else:
                 messagebox.showwarning("Warning", "The application may not function correctly without a valid database.")
         else:
             # Check if the table exists
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            if not cursor.fetchone():
+            if not db_functions.table_exists(db_path, table_name):
                 if messagebox.askyesno("Table Not Found", f"The table '{table_name}' does not exist in the database. Would you like to create it?"):
-                    db_functions.create_db(db_path, table_name)
+                    db_functions.create_db(db_path, table_name, self.get("timestamp_storage"))
                     messagebox.showinfo("Success", f"Table '{table_name}' created in the database.")
                 else:
                     messagebox.showwarning("Warning", "The application may not function correctly without the required table.")
-            conn.close()
+            else:
+                # Bring existing databases up to the current schema (indexes etc.)
+                try:
+                    db_functions.migrate_db(db_path, table_name)
+                except Exception as e:
+                    messagebox.showerror("Error", f"Failed to update the database schema: {str(e)}")
 
     def save_config(self):
         with open(self.config_file, 'w') as f:
@@ -127,11 +121,11 @@ class Config:
                             try:
                                 if os.path.exists(new_db_path):
                                     if messagebox.askyesno("Confirm Overwrite", f"The file {new_db_path} already exists. Do you want to overwrite it?"):
-                                        os.remove(new_db_path)
+                                        db_functions.remove_db(new_db_path)
                                     else:
                                         return
     
-                                db_functions.create_db(new_db_path, self.default_config["table_name"])
+                                db_functions.create_db(new_db_path, self.default_config["table_name"], self.default_config["timestamp_storage"])
     
                                 # Update the entry widget
                                 entries["db_path"].delete(0, tk.END)
@@ -180,7 +174,7 @@ class Config:
         advanced_row = 0
     
         for key, value in self.default_config.items():
-            if key in ["table_name", "update_interval", "graph_points", "debug_mode"]:
+            if key in ["table_name", "timestamp_storage", "partition_by", "archive_path", "archive_after_days", "backup_path", "backup_time", "backup_keep", "update_interval", "missed_tick_policy", "write_batch_size", "write_flush_interval", "graph_points", "graph_min_points", "ui_refresh_interval", "export_chunk_size", "read_mode", "sensor_timeout", "sensor_max_attempts", "sensor_rescan_interval", "sensor_map_path", "debug_mode"]:
                 advanced_row = create_config_entry(advanced_frame, key, value, advanced_row)
             else:
                 regular_row = create_config_entry(regular_frame, key, value, regular_row)
@@ -203,6 +197,10 @@ class Config:
         button_frame.grid(column=0, row=regular_row+2, columnspan=3, sticky=(tk.W, tk.E), pady=10)
     
         def save_changes():
+            partition_by = entries["partition_by"].get()
+            if partition_by not in db_functions.PARTITION_BY_VALUES:
+                messagebox.showerror("Error", f"Partition by must be one of: {', '.join(db_functions.PARTITION_BY_VALUES)}")
+                return
             for key, entry in entries.items():
                 if key == "temperature_range":
                     min_temp, max_temp = entry
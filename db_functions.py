@@ -1,16 +1,499 @@
 import sqlite3
 import csv
+import datetime
+import gzip
+import io
 import os
-from tkinter import filedialog
-import tkinter as tk
-from configuration import Config
+import shutil
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from settings import load_config
 
-def export_to_csv(database_name:str, table_name:str, default_path:str = None):
+# pyarrow (Parquet and Arrow IPC exports) and zstandard (zstd compressed CSV exports) are optional
+# and imported by the export functions that use them, the headless logger never loads them
+# Connection settings. WAL lets the graph/filter readers run while the logger writes,
+# synchronous=NORMAL only syncs on checkpoints instead of on every commit.
+JOURNAL_MODE = "WAL"
+SYNCHRONOUS = "NORMAL"
+BUSY_TIMEOUT = 30  # in seconds, how long a statement waits for a lock before failing
+CACHED_STATEMENTS = 128  # prepared statements kept per connection
+
+# Long-lived connections, one per database file and thread
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+def get_connection(database_name:str):
+    # Returns the calling thread's connection to database_name, opening it on first use
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    key = os.path.abspath(database_name)
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(database_name, timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS, check_same_thread=False)
+        conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        connections[key] = conn
+        with _connections_lock:
+            _connections.append((key, conn, connections))
+    return conn
+
+def close_connections(database_name:str = None, this_thread:bool = False):
+    # Close the connections of every thread (to one database file, or to all of them).
+    # Call it when the threads using them are done, e.g. on shutdown or before removing a database file.
+    # this_thread only closes the calling thread's connections, e.g. before a worker thread exits.
+    key = os.path.abspath(database_name) if database_name is not None else None
+    own = getattr(_local, "connections", None)
+    with _connections_lock:
+        for entry in list(_connections):
+            conn_key, conn, owner = entry
+            if key is not None and conn_key != key:
+                continue
+            if this_thread and owner is not own:
+                continue
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Error while closing database connection: {e}")
+            owner.pop(conn_key, None)
+            _connections.remove(entry)
+
+def remove_db(database_name:str):
+    # Delete a database file together with its WAL files
+    # Partition files next to the database go with it, archived ones are kept
+    if os.path.exists(database_name):
+        for table_name in list_partition_tables(database_name):
+            for _, _, path, archived in list_partitions(database_name, table_name):
+                if not archived:
+                    remove_db(path)
+    close_connections(database_name)
+    invalidate_query_cache(database_name)
+    for key in [key for key in _epoch_tables if key[0] == os.path.abspath(database_name)]:
+        del _epoch_tables[key]
+    for path in (database_name, database_name + "-wal", database_name + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+# Timestamp storage. The data column holds either '%Y-%m-%d %H:%M:%S' text (original schema)
+# or INTEGER epoch seconds (compact schema). Queries go through the helpers below, so both
+# layouts return the same text timestamps to the rest of the app.
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_epoch_tables = {}
+
+def uses_epoch(database_name:str, table_name:str):
+    key = (os.path.abspath(database_name), table_name)
+    if key not in _epoch_tables:
+        conn = get_connection(database_name)
+        columns = {row[1]: row[2] for row in conn.execute(f"PRAGMA table_info({table_name})")}
+        if not columns:
+            return False  # Table does not exist yet, do not cache
+        _epoch_tables[key] = columns.get("data", "").upper() == "INTEGER"
+    return _epoch_tables[key]
+
+def timestamp_sql(database_name:str, table_name:str, expression:str = "data"):
+    # SQL that returns a timestamp expression as local '%Y-%m-%d %H:%M:%S' text
+    if uses_epoch(database_name, table_name):
+        return f"datetime({expression}, 'unixepoch', 'localtime')"
+    return expression
+
+def timestamp_param(database_name:str, table_name:str, value):
+    # Encode a datetime or timestamp string the way the data column stores it
+    epoch = uses_epoch(database_name, table_name)
+    if isinstance(value, str):
+        if not epoch:
+            return value
+        value = datetime.datetime.strptime(value.split('.')[0], TIMESTAMP_FORMAT)
+    if epoch:
+        return int(value.timestamp())
+    return value.strftime(TIMESTAMP_FORMAT)
+
+# Partitions. With partition_by set to "day", "month" or "year" new rows go to one database file
+# per period next to the main one (sensor_database_2024-01.db). The main file keeps the rows written
+# before and a catalog of the partitions. Readers ATTACH the partitions overlapping the requested
+# range, sample ids continue across files so they stay unique.
+PARTITION_LABELS = {"day": "%Y-%m-%d", "month": "%Y-%m", "year": "%Y"}
+PARTITION_BY_VALUES = ("none",) + tuple(PARTITION_LABELS)  # valid partition_by settings
+ATTACH_BATCH = 8  # partitions attached at once, SQLite allows 10 attached databases by default
+
+def _parse_time(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value.split('.')[0], TIMESTAMP_FORMAT)
+    return value.replace(microsecond=0)
+
+def partition_bounds(timestamp, partition_by:str):
+    # Start and end (exclusive) of the period a timestamp belongs to, local time
+    start = _parse_time(timestamp).replace(hour=0, minute=0, second=0)
+    if partition_by == "day":
+        return start, start + datetime.timedelta(days=1)
+    if partition_by == "month":
+        start = start.replace(day=1)
+        return start, (start + datetime.timedelta(days=32)).replace(day=1)
+    if partition_by == "year":
+        start = start.replace(month=1, day=1)
+        return start, start.replace(year=start.year + 1)
+    raise ValueError(f"Unknown partition_by value: {partition_by}")
+
+def partition_path(database_name:str, start, partition_by:str):
+    base, extension = os.path.splitext(database_name)
+    return f"{base}_{start.strftime(PARTITION_LABELS[partition_by])}{extension or '.db'}"
+
+def _has_partition_catalog(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='partitions'").fetchone() is not None
+
+def list_partition_tables(database_name:str):
+    conn = get_connection(database_name)
+    if not _has_partition_catalog(conn):
+        return []
+    return [row[0] for row in conn.execute("SELECT DISTINCT table_name FROM partitions")]
+
+def list_partitions(database_name:str, table_name:str, start_time=None, end_time=None):
+    # (start, end, path, archived) of the partitions overlapping start_time..end_time, oldest first
+    conn = get_connection(database_name)
+    if not _has_partition_catalog(conn):
+        return []
+    query = "SELECT start_time, end_time, path, archived FROM partitions WHERE table_name = ?"
+    params = [table_name]
+    if start_time is not None:
+        query += " AND end_time > ?"
+        params.append(_parse_time(start_time).strftime(TIMESTAMP_FORMAT))
+    if end_time is not None:
+        query += " AND start_time <= ?"
+        params.append(_parse_time(end_time).strftime(TIMESTAMP_FORMAT))
+    return conn.execute(query + " ORDER BY start_time", params).fetchall()
+
+def partition_paths(database_name:str, table_name:str, start_time=None, end_time=None):
+    # Partition files overlapping the range, archives that are not reachable are left out
+    paths = []
+    for _, _, path, _ in list_partitions(database_name, table_name, start_time, end_time):
+        if os.path.exists(path):
+            paths.append(path)
+        else:
+            print(f"Partition {path} is missing, its rows are left out")
+    return paths
+
+def ensure_partition(database_name:str, table_name:str, start, end, partition_by:str):
+    # Path of the partition for the period start..end, created with the layout of the main table when missing
+    conn = get_connection(database_name)
+    with conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS partitions (
+            table_name TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            path TEXT NOT NULL,
+            archived INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (table_name, start_time)
+        )""")
+    row = conn.execute("SELECT path FROM partitions WHERE table_name = ? AND start_time = ?",
+                       (table_name, start.strftime(TIMESTAMP_FORMAT))).fetchone()
+    if row is not None:
+        return row[0]
+
+    path = partition_path(database_name, start, partition_by)
+    definition = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()[0]
+    partition = get_connection(path)
+    with partition:
+        partition.execute(definition.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+    migrate_db(path, table_name)
+    with conn:
+        conn.execute("INSERT INTO partitions (table_name, start_time, end_time, path) VALUES (?, ?, ?, ?)",
+                     (table_name, start.strftime(TIMESTAMP_FORMAT), end.strftime(TIMESTAMP_FORMAT), path))
+    print(f"New partition {path} for {table_name}")
+    return path
+
+def source_sql(schemas, table_name:str):
+    # The table itself, or the UNION ALL of the same table in every attached schema
+    if schemas == ["main"]:
+        return table_name
+    return "(" + " UNION ALL ".join(f"SELECT * FROM {schema}.{table_name}" for schema in schemas) + ")"
+
+def samples_sql(schemas, table_name:str):
+    # Sample rows (id, data, T1, T2, T3, comment) with the comments joined in from the annotations of each file
+    return "(" + " UNION ALL ".join(f"""
+        SELECT s.id, s.data, s.T1, s.T2, s.T3, a.comment
+        FROM {schema}.{table_name} s LEFT JOIN {schema}.{annotation_table(table_name)} a ON a.sample_id = s.id"""
+        for schema in schemas) + ")"
+
+def query_partitions(database_name:str, table_name:str, build_query, params=(), start_time=None, end_time=None):
+    """
+    Run a query over the main table and the partitions overlapping start_time..end_time.
+
+    build_query gets the schema names of one batch ("main", "part0", ...) and returns the SQL.
+    Yields one cursor per batch of attached partitions, oldest batch first. Read each cursor
+    before asking for the next one, the batch is detached then.
+    """
+    conn = get_connection(database_name)
+    paths = partition_paths(database_name, table_name, start_time, end_time)
+    sources = [None] + paths
+    for first in range(0, len(sources), ATTACH_BATCH):
+        schemas = []
+        try:
+            for path in sources[first:first + ATTACH_BATCH]:
+                if path is None:
+                    schemas.append("main")
+                    continue
+                schema = f"part{len(schemas)}"
+                conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+                schemas.append(schema)
+            cursor = conn.execute(build_query(schemas), params)
+            try:
+                yield cursor
+            finally:
+                # An open statement keeps the schemas locked, also when the consumer stopped early
+                cursor.close()
+        finally:
+            try:
+                for schema in schemas:
+                    if schema != "main":
+                        conn.execute(f"DETACH DATABASE {schema}")
+            except sqlite3.Error as e:
+                # Schemas left attached would make every later query on this connection fail
+                print(f"Failed to detach partitions of {database_name}: {e}")
+                close_connections(database_name, this_thread=True)
+
+class ChainedCursor:
+    # Reads the cursors of query_partitions() one after another, the export writers see a single cursor
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.cursor = next(cursors)
+        self.description = self.cursor.description
+
+    def fetchmany(self, size):
+        while True:
+            rows = self.cursor.fetchmany(size)
+            if rows:
+                return rows
+            try:
+                self.cursor = next(self.cursors)
+            except StopIteration:
+                return []
+
+def last_sample_id(database_name:str, table_name:str):
+    # Highest id over the main table and every partition
+    build_query = lambda schemas: " UNION ALL ".join(f"SELECT MAX(id) FROM {schema}.{table_name}" for schema in schemas)
+    return max((row[0] or 0 for cursor in query_partitions(database_name, table_name, build_query) for row in cursor), default=0)
+
+def archive_partitions(database_name:str, table_name:str, archive_path:str, older_than_days:float):
+    # Move partitions whose period ended more than older_than_days ago to archive_path. They stay
+    # in the catalog and are still read while the archive directory is reachable.
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=older_than_days)
+    conn = get_connection(database_name)
+    moved = 0
+    for start, end, path, archived in list_partitions(database_name, table_name):
+        if archived or _parse_time(end) > cutoff or not os.path.exists(path):
+            continue
+        # Fold the WAL into the database file so only one file has to be moved
+        get_connection(path).execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        close_connections(path)
+        os.makedirs(archive_path, exist_ok=True)
+        target = os.path.join(archive_path, os.path.basename(path))
+        shutil.move(path, target)
+        for leftover in (path + "-wal", path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        with conn:
+            conn.execute("UPDATE partitions SET path = ?, archived = 1 WHERE table_name = ? AND start_time = ?", (target, table_name, start))
+        print(f"Partition {path} archived to {target}")
+        moved += 1
+    return moved
+
+# Online backups with the SQLite backup API, copied in steps of BACKUP_PAGES pages while the logger
+# keeps writing. Every source holds a read transaction for the whole copy, in WAL mode that pins one
+# snapshot without blocking the writer, so the steps never restart and the copy has no gaps.
+BACKUP_PAGES = 1024
+BACKUP_SLEEP = 0.05  # seconds between steps, leaves the disk and the locks to the sampler
+BACKUP_FOLDER_FORMAT = "%Y-%m-%d_%H%M%S"
+
+def backup_db(database_name:str, table_name:str, backup_dir:str, pages:int = BACKUP_PAGES, sleep:float = BACKUP_SLEEP, progress=None):
+    """
+    Copy the database and its partitions (archived ones excepted) to a new timestamped
+    folder in backup_dir, restore by copying the files back. progress(copied_pages,
+    total_pages, path) is called after every step. Returns the folder.
+    """
+    files = [database_name] + [path for _, _, path, archived in list_partitions(database_name, table_name)
+                               if not archived and os.path.exists(path)]
+    folder = os.path.join(backup_dir, datetime.datetime.now().strftime(BACKUP_FOLDER_FORMAT))
+    while os.path.exists(folder):
+        # Two backups in the same second, the folder name has to be unique
+        time.sleep(1)
+        folder = os.path.join(backup_dir, datetime.datetime.now().strftime(BACKUP_FOLDER_FORMAT))
+    os.makedirs(folder)
+    sources = []
+    try:
+        # Take every snapshot before copying so all files show (almost) the same moment
+        for path in files:
+            source = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            sources.append(source)
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        for path, source in zip(files, sources):
+            target_path = os.path.join(folder, os.path.basename(path))
+            target = sqlite3.connect(target_path + ".part")
+
+            def step(status, remaining, total, path=path):
+                if progress is not None:
+                    progress(total - remaining, total, path)
+                time.sleep(sleep)
+
+            try:
+                source.backup(target, pages=pages, progress=step)
+            finally:
+                target.close()
+            os.replace(target_path + ".part", target_path)
+    except Exception:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    finally:
+        for source in sources:
+            source.close()
+    print(f"Backup of {database_name} written to {folder}")
+    return folder
+
+def list_backups(backup_dir:str):
+    # (time, folder) of the backups in backup_dir, oldest first
+    backups = []
+    if os.path.isdir(backup_dir):
+        for name in os.listdir(backup_dir):
+            try:
+                backups.append((datetime.datetime.strptime(name, BACKUP_FOLDER_FORMAT), os.path.join(backup_dir, name)))
+            except ValueError:
+                continue  # Not made by backup_db, leave it alone
+    return sorted(backups)
+
+def prune_backups(backup_dir:str, keep:int):
+    # Delete all but the newest keep backups
+    backups = list_backups(backup_dir)
+    for _, folder in backups[:max(len(backups) - keep, 0)]:
+        shutil.rmtree(folder)
+        print(f"Old backup {folder} removed")
+
+# Rows fetched from SQLite per step when exporting, memory use does not grow with the table
+EXPORT_CHUNK_SIZE = 5000
+
+def iter_chunks(cursor, chunk_size:int = EXPORT_CHUNK_SIZE):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+def open_csv_file(output_name:str):
+    # Text file for CSV output, compressed on the fly for .gz and .zst names
+    lower_name = output_name.lower()
+    if lower_name.endswith(".gz"):
+        return gzip.open(output_name, "wt", newline="", encoding="utf-8", compresslevel=6)
+    if lower_name.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compressed exports need the zstandard package (pip install zstandard)")
+        compressor = zstandard.ZstdCompressor(level=10)
+        return io.TextIOWrapper(compressor.stream_writer(open(output_name, "wb")), newline="", encoding="utf-8")
+    return open(output_name, "w", newline="", encoding="utf-8")
+
+def write_csv(cursor, output_name:str, chunk_size:int = EXPORT_CHUNK_SIZE):
+    # Stream the result of an executed query to a CSV file, returns the number of rows written
+    column_names = [description[0] for description in cursor.description]
+    count = 0
+    with open_csv_file(output_name) as csv_file:
+        csv_writer = csv.writer(csv_file)
+
+        # Write the column names as the first row
+        csv_writer.writerow(column_names)
+
+        for rows in iter_chunks(cursor, chunk_size):
+            csv_writer.writerows(rows)
+            count += len(rows)
+    return count
+
+# Columnar exports, typed timestamp and float columns
+PARQUET_EXTENSIONS = (".parquet",)
+ARROW_EXTENSIONS = (".arrow", ".feather", ".ipc")
+EXPORT_FILETYPES = [
+    ("CSV files", "*.csv"),
+    ("Compressed CSV files (gzip)", "*.csv.gz"),
+    ("Compressed CSV files (zstd)", "*.csv.zst"),
+    ("Parquet files", "*.parquet"),
+    ("Arrow IPC files", "*.arrow"),
+    ("All files", "*.*")
+]
+
+def arrow_schema(cursor):
+    # Column types by name: data is a timestamp, temperatures are floats, id is an integer, the rest text
+    import pyarrow as pa
+    fields = []
+    for description in cursor.description:
+        name = description[0]
+        if name == "data":
+            fields.append(pa.field(name, pa.timestamp("s")))
+        elif name == "id":
+            fields.append(pa.field(name, pa.int64()))
+        elif name.upper() in SENSOR_COLUMNS or name == "avg_temp":
+            fields.append(pa.field(name, pa.float64()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+def arrow_batches(cursor, schema, chunk_size:int = EXPORT_CHUNK_SIZE):
+    # One record batch per fetchmany chunk
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    for rows in iter_chunks(cursor, chunk_size):
+        columns = []
+        for index, field in enumerate(schema):
+            values = [row[index] for row in rows]
+            if field.name == "data":
+                # Timestamps are parsed for the whole chunk at once
+                text = pa.array([value.split('.')[0] if value is not None else None for value in values], pa.string())
+                columns.append(pc.strptime(text, format=TIMESTAMP_FORMAT, unit="s", error_is_null=True))
+            else:
+                columns.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+def write_arrow(cursor, output_name:str, chunk_size:int = EXPORT_CHUNK_SIZE):
+    # Stream the result of an executed query to a Parquet or Arrow IPC file (zstd compressed),
+    # every chunk becomes a row group / record batch. Returns the number of rows written.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet and Arrow exports need the pyarrow package (pip install pyarrow)")
+    schema = arrow_schema(cursor)
+    count = 0
+    if output_name.lower().endswith(PARQUET_EXTENSIONS):
+        writer = pq.ParquetWriter(output_name, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(output_name, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    with writer:
+        for batch in arrow_batches(cursor, schema, chunk_size):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    return count
+
+def write_export(cursor, output_name:str, chunk_size:int = EXPORT_CHUNK_SIZE):
+    # File format follows the extension: .parquet, .arrow/.feather/.ipc, anything else is CSV
+    # (gzip or zstd compressed when the name ends with .gz or .zst)
+    if output_name.lower().endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS):
+        return write_arrow(cursor, output_name, chunk_size)
+    return write_csv(cursor, output_name, chunk_size)
+
+def export_to_csv(database_name:str, table_name:str, default_path:str = None, chunk_size:int = EXPORT_CHUNK_SIZE):
     # Get the default path from config if not provided
     if default_path is None:
-        config = Config()
+        config = load_config()
         default_path = config.get("export_filepath", "")
 
+    # Tk is only imported for the save dialog, the headless logger runs without it
+    import tkinter as tk
+    from tkinter import filedialog
+
     # Create a root window and hide it
     root = tk.Tk()
     root.withdraw()
@@ -18,8 +501,8 @@ def export_to_csv(database_name:str, table_name:str, default_path:str = None):
     # Open file dialog to choose save path and filename
     output_name = filedialog.asksaveasfilename(
         defaultextension=".csv",
-        filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-        title="Save CSV file as",
+        filetypes=EXPORT_FILETYPES,
+        title="Save export file as",
         initialdir=default_path
     )
 
@@ -28,76 +511,167 @@ def export_to_csv(database_name:str, table_name:str, default_path:str = None):
         print("Export cancelled.")
         return
 
-    # Connect to the database
-    conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
-
-    # Query to fetch all data from the table
-    query = f"SELECT * FROM {table_name}"
-    cursor.execute(query)
+    # Query to fetch all data from the table (and its partitions)
+    build_query = lambda schemas: f"""
+    SELECT id, {timestamp_sql(database_name, table_name)} AS data, T1, T2, T3, IFNULL(comment, '') AS comment
+    FROM {samples_sql(schemas, table_name)}
+    ORDER BY id
+    """
+    cursor = ChainedCursor(query_partitions(database_name, table_name, build_query))
 
-    # Fetch column names
-    column_names = [description[0] for description in cursor.description]
+    # Stream the rows to the file in chunks, the format follows the file extension
+    try:
+        count = write_export(cursor, output_name, chunk_size)
+    except RuntimeError as e:
+        print(f"Export failed: {e}")
+        return
 
-    # Open a CSV file to write data
-    with open(output_name, "w", newline="", encoding="utf-8") as csv_file:
-        csv_writer = csv.writer(csv_file)
+    print(f"Export complete! {count} records saved as: {output_name}")
 
-        # Write the column names as the first row
-        csv_writer.writerow(column_names)
 
-        # Write all rows from the database table
-        csv_writer.writerows(cursor.fetchall())
+def insert_data_to_db(database_name:str, table_name:str, date: str, t1: float, t2: float, t3: float):
+    # Insert data through the shared connection (avoids accidental UI variable polluting the DB)
+    write_rows(database_name, table_name, [(date, t1, t2, t3)])
+    print(f"Data inserted into the database: {date, t1, t2, t3}")
 
-    # Close the database connection
-    conn.close()
+def insert_many_to_db(database_name:str, table_name:str, rows, partition_by:str = "none"):
+    # Insert (date, t1, t2, t3) rows in a single transaction (one per partition file)
+    count, last = len(rows), rows[-1]
+    write_rows(database_name, table_name, rows, partition_by)
+    print(f"{count} records inserted into the database, last: {last}")
 
-    print(f"Export complete! File saved as: {output_name}")
+def write_rows(database_name:str, table_name:str, rows, partition_by:str = "none"):
+    # Insert the rows and add them to the rollup tables in the same transaction.
+    # With partition_by ("day", "month", "year") every row goes to the partition file of its period.
+    # Each file commits on its own: the rows of a committed file are removed from the rows list,
+    # so when a later file fails the list holds exactly the rows that still have to be written.
+    if not rows:
+        return
+    dates = [_parse_time(row[0]) for row in rows]
+    if partition_by in (None, "none"):
+        targets = {database_name: rows}
+    else:
+        periods = {}
+        for row in rows:
+            periods.setdefault(partition_bounds(row[0], partition_by), []).append(row)
+        targets = {ensure_partition(database_name, table_name, start, end, partition_by): period_rows
+                   for (start, end), period_rows in periods.items()}
 
+    partitions = list_partitions(database_name, table_name)
+    try:
+        for target, target_rows in targets.items():
+            # Only the newest partition is known to hold the highest id (once it has rows),
+            # any other file continues after the highest id of all of them
+            first_id = None
+            if partitions and (target != partitions[-1][2]
+                               or get_connection(target).execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0] is None):
+                first_id = last_sample_id(database_name, table_name) + 1
+            _insert_rows(target, table_name, target_rows, first_id)
+            written = set(map(id, target_rows))
+            rows[:] = [row for row in rows if id(row) not in written]
+    finally:
+        invalidate_query_cache(database_name, table_name, min(dates), max(dates))
 
-def insert_data_to_db(database_name:str, table_name:str, date: str, t1: float, t2: float, t3: float):
-    # Connect to the database and insert data (avoids accidental UI variable polluting the DB)
-    conn = sqlite3.connect(database_name)
+def _insert_rows(database_name:str, table_name:str, rows, first_id:int = None):
+    # first_id: lowest id the new rows may get, keeps ids unique over the main file and its partitions
+    conn = get_connection(database_name)
     query = f"""
     INSERT INTO {table_name} (data, t1, t2, t3)
     VALUES (?, ?, ?, ?)
     """
-    cursor = conn.cursor()
-    cursor.execute(query, (date, t1, t2, t3))
-    conn.commit()
-    conn.close()
-    print(f"Data inserted into the database: {date, t1, t2, t3}")
+    encoded = [(timestamp_param(database_name, table_name, date), t1, t2, t3) for date, t1, t2, t3 in rows]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_id = conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0] or 0
+        if first_id is not None:
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table_name,)).fetchone()
+            if sequence is None:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table_name, first_id - 1))
+            elif sequence[0] < first_id - 1:
+                conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (first_id - 1, table_name))
+        conn.executemany(query, encoded)
+        update_rollups(database_name, table_name, last_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+class BufferedWriter:
+    def __init__(self, database_name:str, table_name:str, batch_size:int = 60, flush_interval:float = 300, partition_by:str = "none"):
+        """
+        Collect samples and write them with one commit per batch.
+
+        A batch is flushed when it holds batch_size samples or when its oldest sample is
+        flush_interval seconds old, whichever comes first. flush_interval is the most data
+        that can be lost if the process dies, call flush() on shutdown.
+        """
+        self.database_name = database_name
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.partition_by = partition_by
+        self.rows = []
+        self.first_row_time = None
+        self.lock = threading.Lock()
+
+    def add(self, date, t1, t2, t3):
+        with self.lock:
+            if not self.rows:
+                self.first_row_time = time.monotonic()
+            self.rows.append((date, t1, t2, t3))
+            due = (len(self.rows) >= self.batch_size
+                   or time.monotonic() - self.first_row_time >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def pending(self):
+        return len(self.rows)
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+            if not rows:
+                return
+            try:
+                insert_many_to_db(self.database_name, self.table_name, rows, self.partition_by)
+            except Exception as e:
+                # Keep the samples for the next flush instead of dropping them.
+                # write_rows left only the rows of the files that were not committed in the list.
+                print(f"An error occurred while writing samples: {e}")
+                self.rows = rows + self.rows
     
 def fetch_last_n_records(database, table_name, n):
     # Fetch the last n records from the database table order by id.
-    conn = sqlite3.connect(database)
+    conn = get_connection(database)
     cursor = conn.cursor()
     
     # Query to get the first and last dates of the last n records
     query = f"""
-    SELECT MIN(data), MAX(data)
+    SELECT {timestamp_sql(database, table_name, "MIN(data)")}, {timestamp_sql(database, table_name, "MAX(data)")}
     FROM (
         SELECT data
         FROM {table_name}
         ORDER BY id DESC
-        LIMIT {n}
+        LIMIT ?
     )
     """
     
-    cursor.execute(query)
+    cursor.execute(query, (n,))
     first_date, last_date = cursor.fetchone()
     
-    conn.close()
-    
     return first_date, last_date
     
-def records_by_time_csv(database_name, table_name, start_date, end_date, default_path: str = None):
+def records_by_time_csv(database_name, table_name, start_date, end_date, default_path: str = None, chunk_size:int = EXPORT_CHUNK_SIZE):
     try:
         # Get the default path from config if not provided
         if default_path is None:
-            config = Config()
+            config = load_config()
             default_path = config.get("export_filepath", "")
 
+        # Tk is only imported for the save dialog, the headless logger runs without it
+        import tkinter as tk
+        from tkinter import filedialog
+
         # Create a root window and hide it
         root = tk.Tk()
         root.withdraw()
@@ -106,8 +680,8 @@ def records_by_time_csv(database_name, table_name, start_date, end_date, default
         output_name = filedialog.asksaveasfilename(
             initialfile= f"1wire_{start_date.strftime("%Y%m%d_%H%M%S")}_{end_date.strftime("%Y%m%d_%H%M%S")}.csv",
             defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-            title="Save CSV file as",
+            filetypes=EXPORT_FILETYPES,
+            title="Save export file as",
             initialdir=default_path
         )
 
@@ -115,113 +689,544 @@ def records_by_time_csv(database_name, table_name, start_date, end_date, default
         if not output_name:
             print("Export cancelled.")
             return
-        # Connect to the database
-        conn = sqlite3.connect(database_name)
-        cursor = conn.cursor()
-
-        # Query to fetch data between the specified dates
-        query = f"""
-        SELECT data, T1, T2, T3, comment 
-        FROM {table_name} 
-        WHERE data BETWEEN ? AND ?
-        ORDER BY data;
+        # Query to fetch data between the specified dates, over the partitions of the range.
+        # Filtered and ordered on the stored column (s.data), not on the text alias of epoch timestamps.
+        build_query = lambda schemas: f"""
+        SELECT {timestamp_sql(database_name, table_name)} AS data, T1, T2, T3, IFNULL(comment, '') AS comment 
+        FROM {samples_sql(schemas, table_name)} AS s
+        WHERE s.data BETWEEN ? AND ?
+        ORDER BY s.data;
         """
-        cursor.execute(query, (start_date, end_date))
+        params = (timestamp_param(database_name, table_name, start_date), timestamp_param(database_name, table_name, end_date))
+        cursor = ChainedCursor(query_partitions(database_name, table_name, build_query, params, start_date, end_date))
 
-        # Fetch column names and rows
-        column_names = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
+        # Stream the rows to the file in chunks, the format follows the file extension
+        count = write_export(cursor, output_name, chunk_size)
 
-        # Open a CSV file to write data
-        with open(output_name, "w", newline="", encoding="utf-8") as csv_file:
-            csv_writer = csv.writer(csv_file)
+        print(f"Export complete! {count} records saved as: {output_name}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
 
-            # Write the column names as the header
-            csv_writer.writerow(column_names)
 
-            # Write sanitized rows to the CSV
-            csv_writer.writerows(rows)
+# Query cache. Range results and date ranges are kept per (database, table, range, resolution),
+# least recently used first out. The insert path and add_comment only drop the entries whose
+# range contains the changed timestamps, so graphs of older data stay cached while logging.
+# Writes made by another process are not seen, the cache only covers this process' writes.
+QUERY_CACHE_ENTRIES = 32
+QUERY_CACHE_ROWS = 500000  # total rows kept over all entries
+_query_cache = OrderedDict()  # key -> (rows, value)
+_query_cache_rows = 0
+_query_cache_generation = 0  # bumped on every invalidation, results read before it are not stored
+_query_cache_lock = threading.Lock()
 
-        # Close the database connection
-        conn.close()
+def _cache_key(database_name, table_name, kind, start_time=None, end_time=None, resolution=None):
+    return (os.path.abspath(database_name), table_name, kind, _parse_time(start_time), _parse_time(end_time), resolution)
 
-        print(f"Export complete! File saved as: {output_name}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def cache_get(key):
+    with _query_cache_lock:
+        if key not in _query_cache:
+            return None
+        _query_cache.move_to_end(key)
+        return _query_cache[key][1]
 
+def cache_put(key, value, rows, generation):
+    # generation: _query_cache_generation read before the query ran
+    global _query_cache_rows
+    with _query_cache_lock:
+        if generation != _query_cache_generation or rows > QUERY_CACHE_ROWS:
+            return
+        if key in _query_cache:
+            _query_cache_rows -= _query_cache.pop(key)[0]
+        _query_cache[key] = (rows, value)
+        _query_cache_rows += rows
+        while len(_query_cache) > QUERY_CACHE_ENTRIES or _query_cache_rows > QUERY_CACHE_ROWS:
+            _query_cache_rows -= _query_cache.popitem(last=False)[1][0]
 
-def fetch_filtered_data(db_path, table_name, start_time, end_time):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    query = f"""
-    SELECT id, data, CAST(T1 AS FLOAT), CAST(T2 AS FLOAT), CAST(T3 AS FLOAT), 
+def invalidate_query_cache(database_name:str, table_name:str = None, first=None, last=None, raw_only:bool = False):
+    # Drop the entries of a database (or one table) whose range overlaps first..last, all of them without a range.
+    # Date ranges always go. raw_only keeps rollup results, for changes that do not touch the temperatures.
+    global _query_cache_rows, _query_cache_generation
+    database_name = os.path.abspath(database_name)
+    first, last = _parse_time(first), _parse_time(last)
+    with _query_cache_lock:
+        _query_cache_generation += 1
+        for key in list(_query_cache):
+            key_database, key_table, kind, start, end, resolution = key
+            if key_database != database_name or (table_name is not None and key_table != table_name):
+                continue
+            if first is not None and kind != "date_range":
+                if raw_only and resolution != "raw":
+                    continue
+                # A rollup bucket starts up to one bucket length before the rows it holds
+                bucket = datetime.timedelta(seconds=ROLLUPS.get(resolution, 0))
+                if start > last or end < first - bucket:
+                    continue
+            _query_cache_rows -= _query_cache.pop(key)[0]
+
+def fetch_filtered_data(db_path, table_name, start_time, end_time, resolution="raw"):
+    # resolution: "raw" or one of ROLLUPS, rollup rows hold per-bucket means and have no id or comment
+    key = _cache_key(db_path, table_name, "rows", start_time, end_time, resolution)
+    cached = cache_get(key)
+    if cached is not None:
+        return list(cached)
+    generation = _query_cache_generation
+    if resolution != "raw":
+        data = fetch_rollup_data(db_path, table_name, start_time, end_time, resolution)
+    else:
+        data = _fetch_raw_data(db_path, table_name, start_time, end_time)
+    cache_put(key, tuple(data), len(data), generation)
+    return data
+
+def _fetch_raw_data(db_path, table_name, start_time, end_time):
+    build_query = lambda schemas: f"""
+    SELECT id, {timestamp_sql(db_path, table_name)}, CAST(T1 AS FLOAT), CAST(T2 AS FLOAT), CAST(T3 AS FLOAT), 
            CAST((T1 + T2 + T3) / 3.0 AS FLOAT) as avg_temp,
-           comment
-    FROM {table_name}
+           IFNULL(comment, '')
+    FROM {samples_sql(schemas, table_name)}
     WHERE data BETWEEN ? AND ?
     ORDER BY data
     """
-    cursor.execute(query, (start_time.strftime("%Y-%m-%d %H:%M:%S"), end_time.strftime("%Y-%m-%d %H:%M:%S")))
-    data = cursor.fetchall()
-    conn.close()
+    params = (timestamp_param(db_path, table_name, start_time), timestamp_param(db_path, table_name, end_time))
+    data = []
+    for cursor in query_partitions(db_path, table_name, build_query, params, start_time, end_time):
+        data.extend(cursor.fetchall())
     return data
 
-def add_comment(database_name, table_name, timestamp:str, comment:str):
+# Columnar fetch for plotting. Times are naive local datetime64[s], temperatures float32 with NaN for missing readings.
+ARRAY_DTYPE = np.dtype([("id", "i8"), ("time", "i8"), ("T1", "f4"), ("T2", "f4"), ("T3", "f4"), ("comment", "O")])
+
+def timestamp_seconds_sql(database_name:str, table_name:str, expression:str = "data"):
+    # Local wall clock time of a timestamp expression as integer seconds since 1970-01-01
+    if uses_epoch(database_name, table_name):
+        return f"CAST(strftime('%s', {expression}, 'unixepoch', 'localtime') AS INTEGER)"
+    return f"CAST(strftime('%s', {expression}) AS INTEGER)"
+
+def fetch_filtered_arrays(db_path, table_name, start_time, end_time, resolution="raw"):
+    """
+    Fetch a time range as NumPy arrays instead of a list of tuples.
+
+    Returns a dict with "id" (int64, -1 for rollup buckets), "time" (datetime64[s]),
+    "temps" (float32, one column per sensor), "avg" (float32) and "comments" (object).
+    Timestamps are converted to integers by SQLite, nothing is parsed per row in Python.
+    The arrays are shared with the query cache and read-only.
+    """
+    key = _cache_key(db_path, table_name, "arrays", start_time, end_time, resolution)
+    cached = cache_get(key)
+    if cached is not None:
+        return dict(cached)
+    generation = _query_cache_generation
+    if resolution == "raw":
+        build_query = lambda schemas: f"""
+        SELECT {array_columns_sql(db_path, table_name)}
+        FROM {samples_sql(schemas, table_name)}
+        WHERE data BETWEEN ? AND ?
+        ORDER BY data
+        """
+    else:
+        means = [f"IFNULL(CAST({c}_sum AS FLOAT) / NULLIF({c}_n, 0), 'nan')" for c in SENSOR_COLUMNS]
+        build_query = lambda schemas: f"""
+        SELECT -1, {timestamp_seconds_sql(db_path, table_name, "bucket")}, {", ".join(means)}, ''
+        FROM {rollup_source_sql(schemas, table_name, resolution)}
+        WHERE bucket BETWEEN {bucket_floor_sql(db_path, table_name, resolution)} AND ?
+        ORDER BY bucket
+        """
+    params = (timestamp_param(db_path, table_name, start_time), timestamp_param(db_path, table_name, end_time))
+    data = arrays_from_records(np.concatenate([
+        np.fromiter(cursor, dtype=ARRAY_DTYPE)
+        for cursor in query_partitions(db_path, table_name, build_query, params, start_time, end_time)
+    ]))
+    for array in data.values():
+        array.setflags(write=False)
+    cache_put(key, data, len(data["id"]), generation)
+    return dict(data)
+
+def array_columns_sql(database_name:str, table_name:str):
+    # Select list matching ARRAY_DTYPE over samples_sql(), NULL readings come back as 'nan' so they fit the float columns
+    return f"""id, {timestamp_seconds_sql(database_name, table_name)},
+               IFNULL(T1, 'nan'), IFNULL(T2, 'nan'), IFNULL(T3, 'nan'), IFNULL(comment, '')"""
+
+def arrays_from_records(records):
+    temps = np.column_stack([records[c] for c in SENSOR_COLUMNS])
+    return {
+        "id": records["id"],
+        "time": records["time"].astype("datetime64[s]"),
+        "temps": temps,
+        "avg": temps.mean(axis=1),  # NaN when a sensor is missing, like the SQL average
+        "comments": records["comment"]
+    }
+
+# Keyset readers. Rows are located through the primary key (rowid) seek, never with OFFSET or a second range scan.
+
+# With partitions they read the files one by one, each file is its own primary key.
+
+def fetch_last_n_arrays(db_path, table_name, n):
+    # The last n rows by id, oldest first. Partitions are read newest first until n rows are found.
+    parts = []
+    for path in reversed([db_path] + partition_paths(db_path, table_name)):
+        query = f"""
+        SELECT {array_columns_sql(path, table_name)}
+        FROM {samples_sql(["main"], table_name)}
+        ORDER BY id DESC
+        LIMIT ?
+        """
+        parts.append(np.fromiter(get_connection(path).execute(query, (n,)), dtype=ARRAY_DTYPE))
+        if sum(len(part) for part in parts) >= n:
+            break
+    records = np.concatenate(parts)
+    return arrays_from_records(np.sort(records, order="id")[-n:] if len(records) else records)
+
+def fetch_id_range_arrays(db_path, table_name, first_id, last_id):
+    # Rows with first_id <= id <= last_id, used to re-read a set of rows that was located before
+    parts = []
+    for path in [db_path] + partition_paths(db_path, table_name):
+        query = f"""
+        SELECT {array_columns_sql(path, table_name)}
+        FROM {samples_sql(["main"], table_name)}
+        WHERE id BETWEEN ? AND ?
+        ORDER BY id
+        """
+        parts.append(np.fromiter(get_connection(path).execute(query, (first_id, last_id)), dtype=ARRAY_DTYPE))
+    records = np.concatenate(parts)
+    return arrays_from_records(np.sort(records, order="id") if len(parts) > 1 else records)
+
+# Comments live in {table}_annotations keyed by sample id, in the same file as the sample
+COMMENT_MAX_LENGTH = 250
+ID_BATCH = 500  # ids per IN (...) lookup, older SQLite builds allow 999 parameters
+
+def annotation_table(table_name:str):
+    return f"{table_name}_annotations"
+
+def set_comments(database_name, table_name, comments):
+    """
+    Set the comments of several samples at once, one transaction per database file.
+
+    comments maps sample id -> text, an empty text removes the comment.
+    Returns the number of samples that were found and updated.
+    """
+    comments = dict(comments)
+    if any(comment and len(comment) > COMMENT_MAX_LENGTH for comment in comments.values()):
+        print(f"Comment is too long. Maximum length is {COMMENT_MAX_LENGTH} characters.")
+        return 0
+    ids = list(comments)
+    times = []
+    for path in [database_name] + partition_paths(database_name, table_name):
+        conn = get_connection(path)
+        # Samples of this file, looked up by primary key
+        found = []
+        for first in range(0, len(ids), ID_BATCH):
+            batch = ids[first:first + ID_BATCH]
+            found += conn.execute(f"SELECT id, {timestamp_sql(path, table_name)} FROM {table_name} WHERE id IN ({', '.join('?' * len(batch))})", batch).fetchall()
+        if not found:
+            continue
+        with conn:
+            conn.executemany(f"""
+            INSERT INTO {annotation_table(table_name)} (sample_id, comment) VALUES (?, ?)
+            ON CONFLICT(sample_id) DO UPDATE SET comment = excluded.comment
+            """, [(sample_id, comments[sample_id]) for sample_id, _ in found if comments[sample_id]])
+            conn.executemany(f"DELETE FROM {annotation_table(table_name)} WHERE sample_id = ?",
+                             [(sample_id,) for sample_id, _ in found if not comments[sample_id]])
+        times += [timestamp for _, timestamp in found]
+    if times:
+        invalidate_query_cache(database_name, table_name, min(times), max(times), raw_only=True)
+    return len(times)
+
+def add_comment(database_name, table_name, sample_id:int, comment:str):
     try:
-        if len(comment)>250:
-            print("Comment is too long. Maximum length is 250 characters.")
-            return
-        
-        # Connect to the database
-        conn = sqlite3.connect(database_name)
-        cursor = conn.cursor()
-        # Update the comment in the database
-        query = f"UPDATE {table_name} SET comment = ? WHERE data = ?"
-        cursor.execute(query, (comment, timestamp))
-        conn.commit()
-        print("Comment updated successfully.")
-        conn.close()
+        if set_comments(database_name, table_name, {sample_id: comment}):
+            print("Comment updated successfully.")
         
     except Exception as e:
         print(f"An error occurred while updating comment: {e}")
         
-def create_db(database_name:str, table_name:str):
+def create_db(database_name:str, table_name:str, timestamp_storage:str = "text"):
+    # timestamp_storage: "text" or "epoch" (compact INTEGER seconds), only used for new tables
     try:
         # Connect to the database
-        conn = sqlite3.connect(database_name)
-        cursor = conn.cursor()
+        conn = get_connection(database_name)
         
+        if timestamp_storage == "epoch":
+            data_column = "data INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"
+        else:
+            data_column = "data DATETIME DEFAULT CURRENT_TIMESTAMP"
+
         # Create the table if it doesn't exist
         query = f"""
         CREATE TABLE IF NOT EXISTS {table_name} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data DATETIME DEFAULT CURRENT_TIMESTAMP,
+            {data_column},
             T1 FLOAT(10,2),
             T2 FLOAT(10,2),
             T3 FLOAT(10,2),
             comment VARCHAR(250) DEFAULT ''
         );
         """
-        cursor.execute(query)
-        conn.commit()
+        with conn:
+            conn.execute(query)
         print("Table created successfully.")
-        conn.close()
+
+        # Indexes and later schema changes
+        migrate_db(database_name, table_name)
     
     except Exception as e:
         print(f"An error occurred while creating table: {e}")
+
+# Rollups. Per bucket and sensor the tables keep the count, sum, min and max of the raw rows,
+# the writer adds new rows as it inserts them and backfill_rollups() rebuilds them from scratch.
+ROLLUPS = {"minute": 60, "hour": 3600, "day": 86400}  # resolution -> bucket length in seconds
+SENSOR_COLUMNS = ("T1", "T2", "T3")
+
+def rollup_table(table_name:str, resolution:str):
+    return f"{table_name}_{resolution}"
+
+def rollup_bucket_sql(database_name:str, table_name:str, resolution:str):
+    # Start of the bucket a row belongs to, encoded like the data column
+    if uses_epoch(database_name, table_name):
+        if resolution == "day":
+            return "CAST(strftime('%s', data, 'unixepoch', 'localtime', 'start of day', 'utc') AS INTEGER)"
+        return f"data - data % {ROLLUPS[resolution]}"
+    return {
+        "minute": "substr(data, 1, 16) || ':00'",
+        "hour": "substr(data, 1, 13) || ':00:00'",
+        "day": "substr(data, 1, 10) || ' 00:00:00'"
+    }[resolution]
+
+def bucket_floor_sql(database_name:str, table_name:str, resolution:str):
+    # Start of the bucket holding the ? parameter. Used as the lower bound of a range, so the
+    # bucket containing start_time (which starts before it) is not dropped.
+    return f"(SELECT {rollup_bucket_sql(database_name, table_name, resolution)} FROM (SELECT ? AS data))"
+
+def rollup_source_sql(schemas, table_name:str, resolution:str):
+    # Buckets on the edge of two files are merged, other buckets are in one file only
+    if schemas == ["main"]:
+        return rollup_table(table_name, resolution)
+    columns = ", ".join(f"SUM({c}_n) AS {c}_n, SUM({c}_sum) AS {c}_sum, MIN({c}_min) AS {c}_min, MAX({c}_max) AS {c}_max"
+                        for c in SENSOR_COLUMNS)
+    return f"(SELECT bucket, SUM(n) AS n, {columns} FROM {source_sql(schemas, rollup_table(table_name, resolution))} GROUP BY bucket)"
+
+def update_rollups(database_name:str, table_name:str, after_id:int = 0, up_to_id:int = None):
+    # Add raw rows with after_id < id <= up_to_id to every rollup table. Runs inside the caller's transaction.
+    conn = get_connection(database_name)
+    columns = ", ".join(f"{c}_n, {c}_sum, {c}_min, {c}_max" for c in SENSOR_COLUMNS)
+    aggregates = ", ".join(f"COUNT({c}), SUM({c}), MIN({c}), MAX({c})" for c in SENSOR_COLUMNS)
+    # Scalar MIN/MAX return NULL if either side is NULL, COALESCE keeps the other side
+    updates = ", ".join(
+        f"{c}_n = {c}_n + excluded.{c}_n, "
+        f"{c}_sum = COALESCE({c}_sum + excluded.{c}_sum, {c}_sum, excluded.{c}_sum), "
+        f"{c}_min = COALESCE(MIN({c}_min, excluded.{c}_min), {c}_min, excluded.{c}_min), "
+        f"{c}_max = COALESCE(MAX({c}_max, excluded.{c}_max), {c}_max, excluded.{c}_max)"
+        for c in SENSOR_COLUMNS
+    )
+    if up_to_id is None:
+        up_to_id = conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0] or 0
+    for resolution in ROLLUPS:
+        conn.execute(f"""
+        INSERT INTO {rollup_table(table_name, resolution)} (bucket, n, {columns})
+        SELECT {rollup_bucket_sql(database_name, table_name, resolution)} AS bucket, COUNT(*), {aggregates}
+        FROM {table_name}
+        WHERE id > ? AND id <= ?
+        GROUP BY bucket
+        ON CONFLICT(bucket) DO UPDATE SET n = n + excluded.n, {updates}
+        """, (after_id, up_to_id))
+
+def create_rollup_tables(conn, table_name:str):
+    columns = ", ".join(f"{c}_n INTEGER NOT NULL, {c}_sum REAL, {c}_min REAL, {c}_max REAL" for c in SENSOR_COLUMNS)
+    for resolution in ROLLUPS:
+        # bucket has no declared type so it keeps the encoding of the data column (text or integer)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {rollup_table(table_name, resolution)} (bucket PRIMARY KEY, n INTEGER NOT NULL, {columns})")
+    # Raw rows with id >= first_id are in the rollups, older ones need backfill_rollups()
+    conn.execute("CREATE TABLE IF NOT EXISTS rollup_state (table_name TEXT PRIMARY KEY, first_id INTEGER NOT NULL)")
+
+def backfill_rollups(database_name:str, table_name:str, partitions:bool = True):
+    # Rebuild every rollup table from the raw rows, safe to run again
+    if partitions:
+        for path in partition_paths(database_name, table_name):
+            backfill_rollups(path, table_name, False)
+    conn = get_connection(database_name)
+    print(f"Building rollups for {table_name}...")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        create_rollup_tables(conn, table_name)
+        for resolution in ROLLUPS:
+            conn.execute(f"DELETE FROM {rollup_table(table_name, resolution)}")
+        update_rollups(database_name, table_name)
+        conn.execute("INSERT OR REPLACE INTO rollup_state (table_name, first_id) VALUES (?, 0)", (table_name,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    invalidate_query_cache(database_name, table_name)
+    print(f"Rollups for {table_name} are up to date.")
+
+def rollups_cover(database_name:str, table_name:str, start_time):
+    # True when every raw row from start_time on is included in the rollups.
+    # Partitions are rolled up from their first row, only the main file can hold rows from
+    # before the rollups existed (ids below rollup_state.first_id), also in partitioned periods.
+    conn = get_connection(database_name)
+    row = conn.execute("SELECT first_id FROM rollup_state WHERE table_name = ?", (table_name,)).fetchone()
+    if row is None:
+        return False
+    missing = conn.execute(f"SELECT 1 FROM {table_name} WHERE id < ? AND data >= ? LIMIT 1",
+                           (row[0], timestamp_param(database_name, table_name, start_time))).fetchone()
+    return missing is None
+
+def choose_resolution(database_name:str, table_name:str, start_time, end_time, min_points:int):
+    # Coarsest rollup that still gives about min_points buckets for the span, "raw" when none does
+    span = (end_time - start_time).total_seconds()
+    for resolution, seconds in sorted(ROLLUPS.items(), key=lambda item: -item[1]):
+        if span / seconds >= min_points:
+            if rollups_cover(database_name, table_name, start_time):
+                return resolution
+            break
+    return "raw"
+
+def fetch_rollup_data(db_path, table_name, start_time, end_time, resolution):
+    # Same row layout as fetch_filtered_data: (id, data, T1, T2, T3, avg_temp, comment) with bucket means
+    means = [f"CAST({c}_sum AS FLOAT) / NULLIF({c}_n, 0)" for c in SENSOR_COLUMNS]
+    build_query = lambda schemas: f"""
+    SELECT NULL, {timestamp_sql(db_path, table_name, "bucket")}, {", ".join(means)},
+           ({" + ".join(means)}) / 3.0 as avg_temp,
+           ''
+    FROM {rollup_source_sql(schemas, table_name, resolution)}
+    WHERE bucket BETWEEN {bucket_floor_sql(db_path, table_name, resolution)} AND ?
+    ORDER BY bucket
+    """
+    params = (timestamp_param(db_path, table_name, start_time), timestamp_param(db_path, table_name, end_time))
+    data = []
+    for cursor in query_partitions(db_path, table_name, build_query, params, start_time, end_time):
+        data.extend(cursor.fetchall())
+    return data
+
+# Schema migrations
+
+def _add_timestamp_index(conn, table_name):
+    # Range filters and MIN/MAX(data) use this index
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_data ON {table_name} (data)")
+
+# Applied in order, a table at schema version n has run the first n steps.
+# New tables are created with the original layout and migrated like existing ones.
+def _add_rollup_tables(conn, table_name):
+    # Existing rows are not rolled up here (that can take minutes), run db_tools.py backfill-rollups
+    create_rollup_tables(conn, table_name)
+    last_id = conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0] or 0
+    conn.execute("INSERT OR REPLACE INTO rollup_state (table_name, first_id) VALUES (?, ?)", (table_name, last_id + 1))
+
+def _add_annotations(conn, table_name):
+    # Comments move to their own table keyed by sample id, the sample rows lose the comment column.
+    # SQLite before 3.35 cannot drop columns, there the old column stays and is no longer read.
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {annotation_table(table_name)} (sample_id INTEGER PRIMARY KEY, comment TEXT NOT NULL)")
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    if "comment" in columns:
+        conn.execute(f"""
+        INSERT OR REPLACE INTO {annotation_table(table_name)} (sample_id, comment)
+        SELECT id, comment FROM {table_name} WHERE comment IS NOT NULL AND comment != ''
+        """)
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            conn.execute(f"ALTER TABLE {table_name} DROP COLUMN comment")
+
+MIGRATIONS = [
+    _add_timestamp_index,
+    _add_rollup_tables,
+    _add_annotations,
+]
+
+def get_schema_version(conn, table_name:str):
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (table_name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    row = conn.execute("SELECT version FROM schema_version WHERE table_name = ?", (table_name,)).fetchone()
+    return row[0] if row else 0
+
+def migrate_db(database_name:str, table_name:str):
+    # Bring table_name up to the latest schema version, every step runs in its own transaction
+    conn = get_connection(database_name)
+    version = get_schema_version(conn, table_name)
+    for number in range(version, len(MIGRATIONS)):
+        migration = MIGRATIONS[number]
+        print(f"Migrating table {table_name} to schema version {number + 1} ({migration.__name__})...")
+        conn.execute("BEGIN")
+        try:
+            migration(conn, table_name)
+            conn.execute("INSERT OR REPLACE INTO schema_version (table_name, version) VALUES (?, ?)", (table_name, number + 1))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    for path in partition_paths(database_name, table_name):
+        migrate_db(path, table_name)
+    return len(MIGRATIONS)
         
+def convert_to_epoch(database_name:str, table_name:str):
+    # Rewrite a text timestamp table to INTEGER epoch seconds. Stop logging to the database first.
+    for path in partition_paths(database_name, table_name):
+        convert_to_epoch(path, table_name)
+    if uses_epoch(database_name, table_name):
+        print(f"Table {table_name} already stores epoch timestamps.")
+        return
+
+    conn = get_connection(database_name)
+    columns = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+    indexes = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (table_name,))]
+
+    # Same columns, only data changes type
+    definitions = []
+    for _, name, column_type, _, default, _ in columns:
+        if name == "id":
+            definitions.append("id INTEGER PRIMARY KEY AUTOINCREMENT")
+        elif name == "data":
+            definitions.append("data INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))")
+        else:
+            definitions.append(f"{name} {column_type}" + (f" DEFAULT {default}" if default is not None else ""))
+    names = ", ".join(column[1] for column in columns)
+    # Stored text is local time, the 'utc' modifier converts it before taking epoch seconds
+    values = ", ".join("CAST(strftime('%s', data, 'utc') AS INTEGER)" if column[1] == "data" else column[1] for column in columns)
+
+    print(f"Converting {table_name} to epoch timestamps...")
+    conn.execute("BEGIN")
+    try:
+        conn.execute(f"CREATE TABLE {table_name}_epoch ({', '.join(definitions)})")
+        conn.execute(f"INSERT INTO {table_name}_epoch ({names}) SELECT {values} FROM {table_name}")
+        conn.execute(f"DROP TABLE {table_name}")
+        conn.execute(f"ALTER TABLE {table_name}_epoch RENAME TO {table_name}")
+        for index in indexes:
+            conn.execute(index)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    _epoch_tables.pop((os.path.abspath(database_name), table_name), None)
+    invalidate_query_cache(database_name, table_name)
+
+    # Rollup buckets are stored in the same encoding, rebuild them (partitions were converted above)
+    backfill_rollups(database_name, table_name, False)
+
+    # Give the space of the text timestamps back to the file system
+    conn.execute("VACUUM")
+    print(f"Table {table_name} converted to epoch timestamps.")
+
+def table_exists(database_name: str, table_name: str):
+    conn = get_connection(database_name)
+    cursor = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+    return cursor.fetchone() is not None
+
 def get_date_range(database_name: str, table_name: str):
-    conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
-    query = f"SELECT MIN(data), MAX(data) FROM {table_name}"
-    cursor.execute(query)
-    min_date, max_date = cursor.fetchone()
-    conn.close()
+    key = _cache_key(database_name, table_name, "date_range")
+    cached = cache_get(key)
+    if cached is not None:
+        return cached
+    generation = _query_cache_generation
+    # Separate subqueries so each one is a single index lookup instead of a scan, one pair per file
+    build_query = lambda schemas: " UNION ALL ".join(f"""
+    SELECT {timestamp_sql(database_name, table_name, f"(SELECT MIN(data) FROM {schema}.{table_name})")},
+           {timestamp_sql(database_name, table_name, f"(SELECT MAX(data) FROM {schema}.{table_name})")}
+    """ for schema in schemas)
+    ranges = [row for cursor in query_partitions(database_name, table_name, build_query) for row in cursor.fetchall()]
+    min_date = min((row[0] for row in ranges if row[0] is not None), default=None)
+    max_date = max((row[1] for row in ranges if row[1] is not None), default=None)
     if min_date is None or max_date is None:
         print("No data found in the table.")
         return None, None
     min_date = min_date.split('.')[0]
     max_date = max_date.split('.')[0]
     print(f"Data range: {min_date} to {max_date}")
+    cache_put(key, (min_date, max_date), 1, generation)
     return min_date, max_date
 
@@ -0,0 +1,49 @@
+import argparse
+import os
+import db_functions
+from settings import load_config
+
+# Maintenance commands for the sensor database, run them while the app is not recording:
+#   python db_tools.py convert-epoch
+#   python db_tools.py backfill-rollups
+#   python db_tools.py archive-partitions --days 90
+#   python db_tools.py backup --to /mnt/usb/backups   (safe while the app is recording)
+#   python db_tools.py --db other.db --table temps convert-epoch
+
+def main():
+    # Defaults come from the app's config file, if there is one
+    defaults = load_config()
+    parser = argparse.ArgumentParser(description="Wire Reader database maintenance")
+    parser.add_argument("--db", default=defaults["db_path"], help="database file (default: db_path from config.json)")
+    parser.add_argument("--table", default=defaults["table_name"], help="table name (default: table_name from config.json)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("convert-epoch", help="store timestamps as integer epoch seconds instead of text")
+    commands.add_parser("backfill-rollups", help="rebuild the minute/hour/day rollup tables from the raw data")
+    archive = commands.add_parser("archive-partitions", help="move partition files of old periods to the archive directory")
+    archive.add_argument("--days", type=float, default=defaults["archive_after_days"], help="archive periods that ended this many days ago (default: archive_after_days from config.json)")
+    archive.add_argument("--to", default=defaults["archive_path"], help="archive directory (default: archive_path from config.json)")
+    backup = commands.add_parser("backup", help="online backup of the database and its partitions")
+    backup.add_argument("--to", default=defaults["backup_path"], help="backup directory (default: backup_path from config.json)")
+    backup.add_argument("--keep", type=int, default=defaults["backup_keep"], help="backups to keep (default: backup_keep from config.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"database {args.db} does not exist")
+
+    try:
+        if args.command == "convert-epoch":
+            db_functions.convert_to_epoch(args.db, args.table)
+        elif args.command == "backfill-rollups":
+            db_functions.migrate_db(args.db, args.table)
+            db_functions.backfill_rollups(args.db, args.table)
+        elif args.command == "archive-partitions":
+            moved = db_functions.archive_partitions(args.db, args.table, args.to, args.days)
+            print(f"{moved} partition(s) archived.")
+        elif args.command == "backup":
+            db_functions.backup_db(args.db, args.table, args.to)
+            db_functions.prune_backups(args.to, args.keep)
+    finally:
+        db_functions.close_connections()
+
+if __name__ == "__main__":
+    main()
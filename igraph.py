@@ -4,6 +4,7 @@ from datetime import datetime
 import db_functions
 import tkinter as tk
 from tkinter import ttk
+from tkinter import messagebox
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import tkinter.simpledialog
 import numpy as np
@@ -11,7 +12,7 @@ from matplotlib.lines import Line2D
 from configuration import Config
 
 class InteractiveTemperaturePlot:
-    def __init__(self, parent, start_time, end_time):
+    def __init__(self, parent, start_time, end_time, last_n=None):
         self.igraph = tk.Toplevel(parent)
         self.igraph.title(f"Temperature Plot {start_time} to {end_time}")
         self.igraph.geometry("1200x600")
@@ -22,6 +23,15 @@ class InteractiveTemperaturePlot:
         self.table_name = self.config.get("table_name")
         self.temp_range = self.config.get("temperature_range")
         
+        # With last_n the rows are read once by primary key and the time range is taken from them
+        self.id_range = None
+        if last_n is not None:
+            self.load_data(db_functions.fetch_last_n_arrays(self.db_path, self.table_name, last_n))
+            if len(self.ids):
+                self.id_range = (int(self.ids[0]), int(self.ids[-1]))
+                start_time, end_time = str(self.timestamp_strings[0]), str(self.timestamp_strings[-1])
+            self.igraph.title(f"Temperature Plot {start_time} to {end_time} (last {last_n} records)")
+
         self.start_time = start_time
         self.end_time = end_time
         
@@ -40,14 +50,16 @@ class InteractiveTemperaturePlot:
             self.end_time = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
 
 
-        # Fetch and prepare data
-        self.dataset = db_functions.fetch_filtered_data(self.db_path, self.table_name, self.start_time, self.end_time)
-        self.timestamps = [datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S') for row in self.dataset]
-        self.temperatures = [float(row[2]) for row in self.dataset]
-        self.temperatures2 = [float(row[3]) for row in self.dataset]
-        self.temperatures3 = [float(row[4]) for row in self.dataset]
-        self.avg_temp = [float(row[5]) for row in self.dataset]
-        self.comments = [row[6] if len(row) > 6 else '' for row in self.dataset]
+        if last_n is not None:
+            self.resolution = "raw"
+        else:
+            # Long ranges are read from the minute/hour/day rollups instead of the raw rows
+            self.resolution = db_functions.choose_resolution(self.db_path, self.table_name, self.start_time, self.end_time, self.config.get("graph_min_points"))
+            if self.resolution != "raw":
+                self.igraph.title(f"Temperature Plot {start_time} to {end_time} ({self.resolution} averages)")
+
+            # Fetch and prepare data
+            self.load_data()
 
 
         # Initialize checkbox variables
@@ -81,6 +93,34 @@ class InteractiveTemperaturePlot:
         # Create Treeview for data table
         self.create_data_table()
 
+    def load_data(self, data=None):
+        # Typed arrays straight from the database, missing readings are NaN (gaps in the plot)
+        if data is None:
+            if self.id_range is not None:
+                data = db_functions.fetch_id_range_arrays(self.db_path, self.table_name, *self.id_range)
+            else:
+                data = db_functions.fetch_filtered_arrays(self.db_path, self.table_name, self.start_time, self.end_time, self.resolution)
+        self.ids = data["id"]
+        self.timestamps = data["time"]
+        self.timestamp_strings = np.char.replace(np.datetime_as_string(self.timestamps, unit='s'), 'T', ' ')
+        self.temperatures = data["temps"][:, 0]
+        self.temperatures2 = data["temps"][:, 1]
+        self.temperatures3 = data["temps"][:, 2]
+        self.avg_temp = data["avg"]
+        self.comments = data["comments"]
+
+    def populate_table(self):
+        # Row iids are the indexes into the data arrays
+        for i in range(len(self.timestamps)):
+            self.data_table.insert('', 'end', iid=str(i), values=(
+                str(self.timestamp_strings[i]),
+                f'{self.temperatures[i]:.2f}',
+                f'{self.temperatures2[i]:.2f}', 
+                f'{self.temperatures3[i]:.2f}',
+                f'{self.avg_temp[i]:.2f}',
+                self.comments[i] or ''
+            ))
+
     def create_control_frame(self):
         # Frame for buttons and controls
         self.control_frame = tk.Frame(self.main_frame)
@@ -170,15 +210,7 @@ class InteractiveTemperaturePlot:
         self.data_table.column('Comment', width=300, anchor='w')
 
         # Populate the table
-        for i in range(len(self.timestamps)):
-            self.data_table.insert('', 'end', values=(
-                self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S'),
-                f'{float(self.temperatures[i]):.2f}',
-                f'{float(self.temperatures2[i]):.2f}', 
-                f'{float(self.temperatures3[i]):.2f}',
-                f'{float(self.avg_temp[i]):.2f}',
-                self.comments[i]
-            ))
+        self.populate_table()
 
         # Configure scrollbar
         self.table_scrollbar.config(command=self.data_table.yview)
@@ -190,9 +222,11 @@ class InteractiveTemperaturePlot:
         self.data_table.bind("<ButtonRelease-1>", self.on_table_select)
     
     def init_plot(self):
-        self.line1, = self.ax.plot(self.timestamps, self.temperatures, c='blue', label="Temp 1", marker='o', linestyle='-', picker=5, markersize=4)
-        self.line2, = self.ax.plot(self.timestamps, self.temperatures2, c='red', label="Temp 2", marker='o', linestyle='-', picker=5, markersize=4)
-        self.line3, = self.ax.plot(self.timestamps, self.temperatures3, c='green', label="Temp 3", marker='o', linestyle='-', picker=5, markersize=4)
+        # Markers only for raw data, they dominate the draw time on long ranges
+        marker = 'o' if self.resolution == "raw" else None
+        self.line1, = self.ax.plot(self.timestamps, self.temperatures, c='blue', label="Temp 1", marker=marker, linestyle='-', picker=5, markersize=4)
+        self.line2, = self.ax.plot(self.timestamps, self.temperatures2, c='red', label="Temp 2", marker=marker, linestyle='-', picker=5, markersize=4)
+        self.line3, = self.ax.plot(self.timestamps, self.temperatures3, c='green', label="Temp 3", marker=marker, linestyle='-', picker=5, markersize=4)
         self.line_avg, = self.ax.plot(self.timestamps, self.avg_temp, c='purple', label="Avg Temp", linestyle='--', linewidth=2)
 
         self.ax.set_xlabel("Time")
@@ -235,9 +269,10 @@ class InteractiveTemperaturePlot:
     def highlight_graph_point(self, index):
         """Highlight only the selected points for a specific timestamp."""
         # Update scatter plots for selected points
-        self.selected_scatter1.set_offsets(np.array([[self.timestamps[index], self.temperatures[index]]]))
-        self.selected_scatter2.set_offsets(np.array([[self.timestamps[index], self.temperatures2[index]]]))
-        self.selected_scatter3.set_offsets(np.array([[self.timestamps[index], self.temperatures3[index]]]))
+        x = mdates.date2num(self.timestamps[index])
+        self.selected_scatter1.set_offsets(np.array([[x, self.temperatures[index]]]))
+        self.selected_scatter2.set_offsets(np.array([[x, self.temperatures2[index]]]))
+        self.selected_scatter3.set_offsets(np.array([[x, self.temperatures3[index]]]))
 
         # Update the canvas to show the changes
         self.canvas.draw_idle()
@@ -260,18 +295,14 @@ class InteractiveTemperaturePlot:
                 self.highlight_graph_point(i)
 
                 # Get the timestamp of the selected point
-                selected_timestamp = self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S')
-
-                # Find the corresponding row in the table
-                for item in self.data_table.get_children():
-                    item_values = self.data_table.item(item)['values']
-                    if item_values[0] == selected_timestamp:
-                        # Select the corresponding row
-                        self.data_table.selection_set(item)
-                        self.data_table.focus(item)
-                        # Scroll to the selected row
-                        self.data_table.yview_moveto(self.data_table.index(item) / len(self.data_table.get_children()))
-                        break
+                selected_timestamp = self.timestamp_strings[i]
+
+                # Select the corresponding row in the table (row iid is the data index)
+                item = str(i)
+                self.data_table.selection_set(item)
+                self.data_table.focus(item)
+                # Scroll to the selected row
+                self.data_table.yview_moveto(i / len(self.timestamps))
 
                 # Update the annotation
                 self.annotation.xy = (x, y)
@@ -290,10 +321,7 @@ class InteractiveTemperaturePlot:
     def on_table_select(self, event):
         selected_item = self.data_table.selection()
         if selected_item:
-            item = self.data_table.item(selected_item)
-            timestamp_str = item['values'][0]
-            timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            index = self.timestamps.index(timestamp)
+            index = int(selected_item[0])
             self.highlight_graph_point(index)
 
     # Setting up on hover
@@ -306,9 +334,9 @@ class InteractiveTemperaturePlot:
                 cont, ind = line.contains(event)
                 if cont:
                     i = ind["ind"][0]  # Get the index of the nearest point
-                    x, y = self.timestamps[i], temps[i]
+                    x, y = mdates.date2num(self.timestamps[i]), temps[i]
                     self.annotation.xy = (x, y)
-                    text = f"Time: {self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S')}\n"
+                    text = f"Time: {self.timestamp_strings[i]}\n"
                     text += f"Temp 1: {self.temperatures[i]:.2f}\n"
                     text += f"Temp 2: {self.temperatures2[i]:.2f}\n"
                     text += f"Temp 3: {self.temperatures3[i]:.2f}\n"
@@ -382,10 +410,10 @@ class InteractiveTemperaturePlot:
             if comment:
                 print(f"Adding comment: {comment} at time {timestamp}")  # Debug print
                 # Find the highest temperature for this timestamp
-                max_temp = max(temp1, temp2, temp3)
+                max_temp = np.nanmax([temp1, temp2, temp3])
                 ann = self.ax.annotate(
                     comment,
-                    (timestamp, max_temp),
+                    (mdates.date2num(timestamp), max_temp),
                     xytext=(10, 10),
                     textcoords='offset points',
                     fontsize=8,
@@ -404,40 +432,32 @@ class InteractiveTemperaturePlot:
 
 
     def update_comment(self):
-        selected_item = self.data_table.selection()
-        if selected_item:
-            item = self.data_table.item(selected_item)
-            timestamp = item['values'][0]
-            comment = item['values'][5]
-            new_comment = tk.simpledialog.askstring("Update Comment", "Enter new comment:", initialvalue=comment)
+        if self.resolution != "raw":
+            messagebox.showinfo("Update Comment", f"This graph shows {self.resolution} averages. Select a shorter range to edit comments on single records.")
+            return
+        selected_items = self.data_table.selection()
+        if selected_items:
+            # Several selected rows get the same comment in one write, rows are addressed by sample id
+            indexes = [int(item) for item in selected_items]
+            comment = self.comments[indexes[0]] or ''
+            prompt = "Enter new comment:" if len(indexes) == 1 else f"Enter new comment for {len(indexes)} records:"
+            new_comment = tk.simpledialog.askstring("Update Comment", prompt, initialvalue=comment)
             if new_comment is not None:
-                db_functions.add_comment(self.db_path, self.table_name, timestamp, new_comment)
+                if len(indexes) == 1:
+                    db_functions.add_comment(self.db_path, self.table_name, int(self.ids[indexes[0]]), new_comment)
+                else:
+                    db_functions.set_comments(self.db_path, self.table_name, {int(self.ids[i]): new_comment for i in indexes})
 
                 # Refresh data and reinitialize plot
                 self.refresh_data()
 
     def refresh_data(self):
         # Re-fetch data and update plot and table
-        self.dataset = db_functions.fetch_filtered_data(self.db_path, self.table_name, self.start_time, self.end_time)
-        self.timestamps = [datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S') for row in self.dataset]
-        self.temperatures = [float(row[2]) for row in self.dataset]
-        self.temperatures2 = [float(row[3]) for row in self.dataset]
-        self.temperatures3 = [float(row[4]) for row in self.dataset]
-        self.avg_temperatures = [float(row[5]) for row in self.dataset]  # Assuming avg_temp is the 6th column
-        self.comments = [row[6] if len(row) > 6 else '' for row in self.dataset]
+        self.load_data()
     
         # Clear and repopulate the table
-        for item in self.data_table.get_children():
-            self.data_table.delete(item)
-        for i in range(len(self.timestamps)):
-            self.data_table.insert('', 'end', values=(
-                self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S'),
-                f'{self.temperatures[i]:.2f}',
-                f'{self.temperatures2[i]:.2f}', 
-                f'{self.temperatures3[i]:.2f}',
-                f'{self.avg_temperatures[i]:.2f}',
-                self.comments[i]
-            ))
+        self.data_table.delete(*self.data_table.get_children())
+        self.populate_table()
         
         # Redraw the plot
         self.ax.clear()
@@ -473,7 +493,7 @@ class InteractiveTemperaturePlot:
         
         default_path = self.config.get("export_path")
         
-        db_functions.records_by_time_csv(self.db_path, self.table_name, self.start_time, self.end_time, default_path)
+        db_functions.records_by_time_csv(self.db_path, self.table_name, self.start_time, self.end_time, default_path, self.config.get("export_chunk_size"))
 
         
     
@@ -0,0 +1,84 @@
+import argparse
+import signal
+import threading
+import time
+import db_functions
+from settings import CONFIG_FILE, load_config
+from acquisition import AcquisitionEngine
+from backup import BackupScheduler
+
+# Headless logger for machines without a display: reads the sensors and records every sample,
+# no Tk or matplotlib is loaded. Settings come from config.json, the flags override them:
+#   python logger.py
+#   python logger.py --interval 1000 --db /data/sensors.db --verbose
+# SIGINT (Ctrl+C) and SIGTERM stop it after the buffered samples are written.
+
+# Seconds between two sampling jitter/overrun lines, and with --verbose
+STATS_INTERVAL = 3600
+VERBOSE_STATS_INTERVAL = 60
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Wire Reader headless logger")
+    parser.add_argument("--config", default=CONFIG_FILE, help=f"config file (default: {CONFIG_FILE})")
+    parser.add_argument("--db", help="database file (default: db_path from the config file)")
+    parser.add_argument("--table", help="table name (default: table_name from the config file)")
+    parser.add_argument("--interval", type=int, help="sampling interval in milliseconds (default: update_interval from the config file)")
+    parser.add_argument("--read-mode", choices=["sequential", "concurrent", "bulk"], help="sensor read mode (default: read_mode from the config file)")
+    parser.add_argument("--batch-size", type=int, help="samples written per commit (default: write_batch_size from the config file)")
+    parser.add_argument("--flush-interval", type=float, help="longest time in seconds a sample waits in the write buffer (default: write_flush_interval from the config file)")
+    parser.add_argument("--debug", action="store_true", help="record random temperatures instead of reading the sensors")
+    parser.add_argument("--verbose", action="store_true", help="print every sample")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    overrides = {
+        "db_path": args.db,
+        "table_name": args.table,
+        "update_interval": args.interval,
+        "read_mode": args.read_mode,
+        "write_batch_size": args.batch_size,
+        "write_flush_interval": args.flush_interval
+    }
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    if args.debug:
+        config["debug_mode"] = True
+
+    db_functions.create_db(config["db_path"], config["table_name"], config["timestamp_storage"])
+
+    engine = AcquisitionEngine(config)
+    engine.recording = True
+    backups = BackupScheduler(config)
+
+    # The handlers only set the event, shutting down happens in the main loop below
+    stop_event = threading.Event()
+    def request_stop(signum, frame):
+        print(f"{signal.Signals(signum).name} received, stopping...")
+        stop_event.set()
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    print(f"Logging to {config['db_path']} every {config['update_interval']} ms")
+    engine.start()
+    backups.start()
+    try:
+        # Samples are stored by the engine thread, the published copies are only printed
+        stats_interval = VERBOSE_STATS_INTERVAL if args.verbose else STATS_INTERVAL
+        last_report = time.monotonic()
+        while not stop_event.wait(1):
+            for data_time, temps in engine.drain():
+                if args.verbose:
+                    print(data_time, *["--" if temp is None else temp for temp in temps])
+            if time.monotonic() - last_report >= stats_interval:
+                last_report = time.monotonic()
+                print(f"Sampling: {engine.scheduler.summary()}")
+    finally:
+        engine.stop()
+        backups.stop()
+        db_functions.close_connections()
+        print(f"Sampling: {engine.scheduler.summary()}")
+        print("Logger stopped, buffered samples written.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import numpy as np
+
+class RingBuffer:
+    def __init__(self, capacity, channels=3):
+        """
+        Fixed-size history of the last `capacity` samples with `channels` values each.
+
+        Every sample is written twice, at i and i + capacity, so the newest window is always one
+        contiguous slice of the storage and values()/times() return views, nothing is copied or
+        allocated per sample. Missing readings (None) are stored as NaN.
+        """
+        self.capacity = capacity
+        self.channels = channels
+        self._values = np.full((channels, 2 * capacity), np.nan)  # one contiguous row per channel
+        self._times = np.zeros(2 * capacity, dtype="datetime64[s]")
+        self._indices = np.arange(capacity)  # x values for plotting against the sample index
+        self._next = 0  # storage position of the next sample, 0 <= _next < capacity
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, values, timestamp=None):
+        # values: one reading per channel, timestamp: datetime, datetime64 or '%Y-%m-%d %H:%M:%S' text
+        position = self._next
+        for channel, value in enumerate(values[:self.channels]):
+            value = np.nan if value is None else value
+            self._values[channel, position] = value
+            self._values[channel, position + self.capacity] = value
+        if timestamp is not None:
+            timestamp = np.datetime64(timestamp, "s")
+            self._times[position] = timestamp
+            self._times[position + self.capacity] = timestamp
+        self._next = (position + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, values, timestamps=None):
+        # values: (n, channels) array-like, oldest first; only the last `capacity` rows are kept
+        values = np.asarray(values, dtype=float)[-self.capacity:]
+        if timestamps is not None:
+            timestamps = np.asarray(timestamps, dtype="datetime64[s]")[-self.capacity:]
+        for row in range(len(values)):
+            self.append(values[row], timestamps[row] if timestamps is not None else None)
+
+    def resize(self, capacity):
+        # New storage of the given size, the newest samples that still fit are kept
+        values, times = self.values(capacity).copy(), self.times(capacity).copy()
+        self.capacity = capacity
+        self._values = np.full((self.channels, 2 * capacity), np.nan)
+        self._times = np.zeros(2 * capacity, dtype="datetime64[s]")
+        self._indices = np.arange(capacity)
+        self.clear()
+        self.extend(values, times)
+
+    def backfill(self, values, timestamps):
+        # Puts older samples (oldest first) in front of the buffered ones, as many as fit.
+        # Samples not older than the oldest buffered one are already in the buffer and ignored.
+        values = np.asarray(values, dtype=float).reshape(-1, self.channels)
+        timestamps = np.asarray(timestamps, dtype="datetime64[s]")
+        if self._count:
+            older = timestamps < self.times()[0]
+            values, timestamps = values[older], timestamps[older]
+        values = np.concatenate([values, self.values()])
+        timestamps = np.concatenate([timestamps, self.times()])
+        self.clear()
+        self.extend(values, timestamps)
+
+    def clear(self):
+        self._values.fill(np.nan)
+        self._next = 0
+        self._count = 0
+
+    def _window(self, n=None):
+        # Storage slice of the newest n samples (all of them by default), oldest first
+        n = self._count if n is None else min(n, self._count)
+        end = self._next + self.capacity if self._count == self.capacity else self._next
+        return slice(end - n, end)
+
+    def values(self, n=None):
+        # (samples, channels) view of the newest n samples
+        return self._values[:, self._window(n)].T
+
+    def channel(self, channel, n=None):
+        # Contiguous view of one channel, ready for Line2D.set_data
+        return self._values[channel, self._window(n)]
+
+    def times(self, n=None):
+        return self._times[self._window(n)]
+
+    def indices(self, n=None):
+        # 0..n-1 as a view, the x values of a plot against the sample index
+        return self._indices[:self._count if n is None else min(n, self._count)]
+
+    def latest(self):
+        # Newest sample as (timestamp, values), None when empty
+        if not self._count:
+            return None
+        window = self._window(1)
+        return self._times[window][0], self._values[:, window][:, 0]
@@ -0,0 +1,44 @@
+import json
+import os
+
+# Configuration without Tk: the defaults and config.json. Used by the headless logger and the
+# command line tools, configuration.Config (the config window) starts from the same defaults.
+
+CONFIG_FILE = "config.json"
+
+# !!! IMPORTANT: DEFAULT_CONFIG is the DEFAULTS set when the config file does not exist. These are enforced when reseting the config. Do not change these values without a deep understanding of the application's behavior.
+DEFAULT_CONFIG = {
+    "db_path": "sensor_database.db",
+    "export_path": ".\database_dump.csv",
+    "export_chunk_size": 5000,  # rows read from the database per step when exporting
+    "temperature_range": [0, 50],
+    "table_name": "temps",
+    "timestamp_storage": "text",  # "text" or "epoch" (compact integer seconds), used when a new table is created
+    "partition_by": "none",  # "none", "day", "month" or "year": new rows go to one database file per period
+    "archive_path": "archive",  # directory old partition files are moved to
+    "archive_after_days": 0,  # partitions whose period ended this many days ago are archived at startup and then once a day, 0 keeps them
+    "backup_path": "backups",  # directory of the online backups, one timestamped folder per backup
+    "backup_time": "",  # "HH:MM" for a daily backup while the app runs, empty disables it
+    "backup_keep": 7,  # number of backups kept, older ones are deleted
+    "update_interval": 5000,  # in milliseconds, sampling interval
+    "missed_tick_policy": "skip",  # "skip" or "catch_up" when a sample runs longer than update_interval
+    "write_batch_size": 60,  # samples written per commit
+    "write_flush_interval": 300,  # in seconds, longest time a sample waits in the write buffer
+    "graph_points": 60,
+    "ui_refresh_interval": 250,  # in milliseconds, the window renders new samples at most this often
+    "graph_min_points": 500,  # range graphs use the coarsest minute/hour/day averages that still give this many points
+    "read_mode": "bulk",  # "sequential", "concurrent" or "bulk"
+    "sensor_timeout": 1500,  # in milliseconds, per tick deadline for sensor reads
+    "sensor_max_attempts": 5,  # reads per sensor per tick before it is marked missing
+    "sensor_rescan_interval": 300,  # in seconds, sysfs is also rescanned after a failed read
+    "sensor_map_path": "sensor_map.json",  # sensor id -> channel (T1/T2/T3) assignments
+    "debug_mode": False # !!! IMPORTANT: Debug mode should be False in a production environment!
+}
+
+def load_config(config_file:str = CONFIG_FILE):
+    # Defaults overlaid with the values saved in the config file, if there is one
+    config = DEFAULT_CONFIG.copy()
+    if os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            config.update(json.load(f))
+    return config
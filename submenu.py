@@ -142,10 +142,9 @@ class Submenu:
             n = tk.simpledialog.askinteger("Input", "Enter the number of last records to plot:", parent=self.window, minvalue=1, maxvalue=100000)
             if n is None:
                 return
-            # Fetch dates from the database
-            start_date, end_date = db_functions.fetch_last_n_records(self.config.get("db_path"), self.config.get("table_name"),n)
-            print(f"Generating graph for last {n} records from {start_date} to {end_date}")
-            InteractiveTemperaturePlot(self.window, start_date, end_date)
+            # The graph window reads the rows itself by id, no separate date range lookup
+            print(f"Generating graph for last {n} records")
+            InteractiveTemperaturePlot(self.window, None, None, last_n=n)
         else:
              # Fetch dates from UI
             start_date, end_date = self.get_date_and_time()
@@ -183,7 +182,7 @@ class Submenu:
         if isinstance(end_date, str):
             end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
         default_path = self.config.get("export_path")
-        db_functions.records_by_time_csv(self.db_path, self.table_name , start_date, end_date, default_path)
+        db_functions.records_by_time_csv(self.db_path, self.table_name , start_date, end_date, default_path, self.config.get("export_chunk_size"))
 
     def close_window(self):
         self.window.destroy()
\ No newline at end of file
@@ -1,29 +1,288 @@
 import glob
+import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Old read functions
 
-# TODO: optimise this function
-
-def find_temp_sensors():
-    base_dir = '/sys/bus/w1/devices/'
-    return glob.glob(base_dir + '28*')
+def find_temp_sensors(base_dir='/sys/bus/w1/devices/'):
+    # Discovery I/O, use SensorRegistry to keep it off the sampling path
+    return glob.glob(os.path.join(base_dir, '28*'))
 
 def read_temp_raw(device_file):
     with open(device_file, 'r') as f:
         return f.readlines()
 
-def read_1wire_sensor(sensor):
+# Delay between reads when the CRC check fails, in seconds
+RETRY_DELAY = 0.2
+
+def read_1wire_sensor(sensor, max_attempts=5, deadline=None):
+    # Retries until the CRC line says YES. Gives up after max_attempts or when the
+    # next attempt would pass the time.monotonic() deadline, and returns None.
+    attempts = 0
     while True:
-        lines = read_temp_raw(sensor + '/w1_slave')
-        if lines[0].strip()[-3:] == 'YES':
+        attempts += 1
+        try:
+            lines = read_temp_raw(sensor + '/w1_slave')
+        except OSError as e:
+            print(f"Failed to read {sensor}: {e}")
+            return None
+        if len(lines) > 1 and lines[0].strip()[-3:] == 'YES':
             equals_pos = lines[1].find('t=')
             if equals_pos != -1:
                 temp_string = lines[1][equals_pos + 2:]
-                return round(float(temp_string) / 1000.0, 2)
-        time.sleep(0.2)
+                try:
+                    return round(float(temp_string) / 1000.0, 2)
+                except ValueError:
+                    # A garbled value is retried like a failed CRC check
+                    print(f"Sensor {sensor} returned an invalid value: {temp_string.strip()!r}")
+        if max_attempts is not None and attempts >= max_attempts:
+            break
+        if deadline is not None and time.monotonic() + RETRY_DELAY >= deadline:
+            break
+        time.sleep(RETRY_DELAY)
+    print(f"Sensor {sensor} gave no valid reading after {attempts} attempts")
+    return None
+
+# Concurrent read functions
+
+# Shared pool so the worker threads are not recreated every tick
+_executor = None
+_executor_workers = 0
+
+# Last read submitted per sensor, a sensor is not resubmitted while that read is still blocked
+_in_flight = {}
+
+def _get_executor(workers):
+    # Replaced by a larger pool when more sensors show up, the old one finishes its reads and exits
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers < workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="w1_read")
+        _executor_workers = workers
+    return _executor
+
+def read_sensors_concurrently(sensors, timeout=None, max_attempts=5):
+    # Start every conversion at once, total wait is about one conversion time
+    # instead of one per sensor. Sensors that miss the deadline return None.
+    if not sensors:
+        return []
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    executor = _get_executor(len(sensors))
+    futures = []
+    for sensor in sensors:
+        previous = _in_flight.get(sensor)
+        if previous is not None and not previous.done():
+            # A hung read keeps its worker, do not queue another one behind it
+            futures.append(None)
+            continue
+        _in_flight[sensor] = executor.submit(read_1wire_sensor, sensor, max_attempts, deadline)
+        futures.append(_in_flight[sensor])
+    wait([future for future in futures if future is not None], timeout=timeout)
+
+    temps = []
+    for sensor, future in zip(sensors, futures):
+        if future is None:
+            print(f"Sensor {sensor} is still busy with an earlier read")
+            temps.append(None)
+        elif future.done() and not future.cancelled() and future.exception() is None:
+            temps.append(future.result())
+        else:
+            # Reads still waiting for a worker are dropped, running ones are left to finish
+            future.cancel()
+            print(f"Sensor {sensor} did not respond within {timeout} s")
+            temps.append(None)
+    return temps
+
+# Bulk read functions (w1_therm therm_bulk_read)
+
+def find_bus_master(sensor):
+    # /sys/bus/w1/devices/28-* links into /sys/devices/w1_bus_masterN/
+    return os.path.dirname(os.path.realpath(sensor))
+
+def has_bulk_read(bus_master):
+    return os.path.exists(os.path.join(bus_master, 'therm_bulk_read'))
+
+def trigger_bulk_conversion(bus_master):
+    # Starts a conversion on every sensor of this bus at the same time
+    with open(os.path.join(bus_master, 'therm_bulk_read'), 'w') as f:
+        f.write('trigger')
+
+def bulk_conversion_pending(bus_master):
+    # -1: conversion in progress, 1: results ready, 0: no bulk read in progress
+    with open(os.path.join(bus_master, 'therm_bulk_read'), 'r') as f:
+        return f.read().strip() == '-1'
+
+def read_temperature_attribute(sensor):
+    # After a bulk conversion the temperature attribute returns the converted value without waiting
+    with open(sensor + '/temperature', 'r') as f:
+        return round(int(f.read().strip()) / 1000.0, 2)
+
+def read_sensors_bulk(sensors, timeout=None, max_attempts=5):
+    # One conversion per bus master, then read every sensor. Buses without
+    # therm_bulk_read fall back to the per-sensor (concurrent) path.
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    buses = {}
+    for sensor in sensors:
+        buses.setdefault(find_bus_master(sensor), []).append(sensor)
+
+    temps = {}
+    bulk_buses = []
+    fallback_sensors = []
+    for bus_master, bus_sensors in buses.items():
+        if has_bulk_read(bus_master):
+            try:
+                trigger_bulk_conversion(bus_master)
+                bulk_buses.append(bus_master)
+                continue
+            except OSError as e:
+                print(f"Bulk conversion failed on {bus_master}: {e}")
+        fallback_sensors.extend(bus_sensors)
+
+    # Per-sensor reads run while the bulk conversions are in progress
+    temps.update(zip(fallback_sensors, read_sensors_concurrently(fallback_sensors, timeout, max_attempts)))
+
+    # Poll until every triggered bus has finished converting
+    pending = list(bulk_buses)
+    failed_buses = []
+    while pending:
+        still_pending = []
+        for bus_master in pending:
+            try:
+                if bulk_conversion_pending(bus_master):
+                    still_pending.append(bus_master)
+            except OSError as e:
+                # A flaky bus only loses its own sensors for this tick
+                print(f"Bulk conversion state unreadable on {bus_master}: {e}")
+                failed_buses.append(bus_master)
+        pending = still_pending
+        if not pending:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"Bulk conversion did not finish within {timeout} s on {', '.join(pending)}")
+            break
+        time.sleep(0.05)
+
+    for bus_master in bulk_buses:
+        for sensor in buses[bus_master]:
+            if bus_master in pending or bus_master in failed_buses:
+                temps[sensor] = None
+                continue
+            try:
+                temps[sensor] = read_temperature_attribute(sensor)
+            except (OSError, ValueError) as e:
+                print(f"Failed to read {sensor}: {e}")
+                temps[sensor] = None
+
+    return [temps[sensor] for sensor in sensors]
+
+def read_sensors(sensors, mode="sequential", timeout=None, max_attempts=5):
+    # mode: "sequential" reads sensors one after another, "concurrent" reads them in parallel,
+    # "bulk" converts all sensors of a bus at once through the bus master.
+    # timeout is the latency budget for the whole tick, sensors that run out of it return None.
+    if mode == "bulk":
+        return read_sensors_bulk(sensors, timeout, max_attempts)
+    if mode == "concurrent":
+        return read_sensors_concurrently(sensors, timeout, max_attempts)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    temps = []
+    for sensor in sensors:
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"No time left in this tick to read {sensor}")
+            temps.append(None)
+            continue
+        temps.append(read_1wire_sensor(sensor, max_attempts, deadline))
+    return temps
+
+def read_1wire_sensors(mode="sequential", timeout=None, registry=None, max_attempts=5):
+    # With a registry the result is ordered by channel (T1, T2, T3...) and discovery is cached
+    if registry is not None:
+        return registry.read(mode, timeout, max_attempts)
+    temps = read_sensors(find_temp_sensors(), mode, timeout, max_attempts)
+    return temps if temps else 'No temperature sensors found' # Return message if no sensors found for debugging
+
+# Sensor registry
+
+class SensorRegistry:
+    def __init__(self, channels=3, rescan_interval=300, map_file="sensor_map.json", base_dir='/sys/bus/w1/devices/'):
+        # channels: number of data columns (T1, T2, T3...)
+        # rescan_interval: seconds between sysfs scans, a failed read also triggers a rescan
+        # map_file: JSON file keeping the sensor id -> channel assignment across restarts
+        self.channels = [f"T{i}" for i in range(1, channels + 1)]
+        self.rescan_interval = rescan_interval
+        self.map_file = map_file
+        self.base_dir = base_dir
+        self.assignments = self.load_assignments()  # sensor id -> channel
+        self.present = {}  # sensor id -> sysfs path of sensors found by the last scan
+        self.failures = {}  # sensor id -> number of failed reads
+        self.last_scan = None
+
+    def load_assignments(self):
+        if self.map_file and os.path.exists(self.map_file):
+            try:
+                with open(self.map_file, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Failed to load sensor map {self.map_file}: {e}")
+        return {}
+
+    def save_assignments(self):
+        if not self.map_file:
+            return
+        try:
+            with open(self.map_file, 'w') as f:
+                json.dump(self.assignments, f, indent=4)
+        except OSError as e:
+            print(f"Failed to save sensor map {self.map_file}: {e}")
+
+    def scan(self):
+        self.present = {os.path.basename(path): path for path in sorted(find_temp_sensors(self.base_dir))}
+        self.last_scan = time.monotonic()
+
+        # New sensors take the first free channel, assigned channels never move
+        changed = False
+        for sensor_id in self.present:
+            if sensor_id in self.assignments:
+                continue
+            free = [channel for channel in self.channels if channel not in self.assignments.values()]
+            if not free:
+                print(f"Sensor {sensor_id} found but all channels are assigned, edit {self.map_file} to use it")
+                continue
+            self.assignments[sensor_id] = free[0]
+            changed = True
+            print(f"Sensor {sensor_id} assigned to {free[0]}")
+        if changed:
+            self.save_assignments()
+
+    def request_rescan(self):
+        self.last_scan = None
+
+    def rescan_due(self):
+        return self.last_scan is None or time.monotonic() - self.last_scan >= self.rescan_interval
+
+    def channel_sensors(self):
+        # Sysfs path per channel, None for channels without a connected sensor
+        paths = {channel: self.present.get(sensor_id) for sensor_id, channel in self.assignments.items()}
+        return [paths.get(channel) for channel in self.channels]
+
+    def read(self, mode="sequential", timeout=None, max_attempts=5):
+        # Channels without a reading (no sensor, failed CRC, out of time) are None
+        if self.rescan_due():
+            self.scan()
+
+        paths = self.channel_sensors()
+        sensors = [path for path in paths if path is not None]
+        readings = dict(zip(sensors, read_sensors(sensors, mode, timeout, max_attempts)))
+        temps = [readings.get(path) if path is not None else None for path in paths]
 
-def read_1wire_sensors():
-    temp_sensors = find_temp_sensors()
-    temps = [read_1wire_sensor(sensor) for sensor in temp_sensors]
-    return temps if temps else 'No temperature sensors found' # Return message if no sensors found for debugging
\ No newline at end of file
+        # A failed read may mean the sensor was unplugged, channels without a sensor wait for the next scan
+        failed = [path for path in sensors if readings[path] is None]
+        for path in failed:
+            sensor_id = os.path.basename(path)
+            self.failures[sensor_id] = self.failures.get(sensor_id, 0) + 1
+            print(f"Sensor {sensor_id} ({self.assignments[sensor_id]}) failed {self.failures[sensor_id]} times")
+        if failed:
+            self.request_rescan()
+        return temps
@@ -1,17 +1,16 @@
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.pyplot as plt
-from collections import deque
+from matplotlib.ticker import AutoMinorLocator, MaxNLocator
 import tkinter as tk
-import debug_functions as debugf
+from tkinter import messagebox
 import db_functions
-import datetime
 from submenu import Submenu
 from configuration import Config
+from acquisition import AcquisitionEngine
+from backup import BackupScheduler
+from ring_buffer import RingBuffer
 import sys
 
-# Old reader implementation
-from wire_reader import read_1wire_sensors
-
 class WireReaderApp:
     def __init__(self):
         """
@@ -37,6 +36,13 @@ class WireReaderApp:
         self.data_temp1 = 0.0
         self.data_temp2 = 0.0
         self.data_temp3 = 0.0
+        self.needs_render = False  # samples arrived that are not drawn yet
+
+        # Sensor reads and database inserts run in the acquisition thread
+        self.engine = AcquisitionEngine(self.config)
+
+        # Online backups, daily at backup_time and from the "Backup DB" button, and partition archiving
+        self.backups = BackupScheduler(self.config)
 
         # Bool for stopping the update loop
         self.inserting_data = False
@@ -44,9 +50,8 @@ class WireReaderApp:
         # Store historical data for the graph
         self.max_points = self.config.get("graph_points")
         
-        self.temps1 = deque(maxlen=self.max_points)
-        self.temps2 = deque(maxlen=self.max_points)
-        self.temps3 = deque(maxlen=self.max_points)
+        # Preallocated, the graph gets views of the newest samples instead of list copies
+        self.history = RingBuffer(self.max_points, channels=3)
 
         # Label Variables for UI
         self.time_now = tk.StringVar()
@@ -63,10 +68,18 @@ class WireReaderApp:
         # Check database connection
         self.check_db_connection()
 
+        # The graph starts with the newest rows already in the database, not empty
+        self.backfill_history()
+
         # Live Graph
         self.create_live_graph()
 
-        # Start updating the GUI
+        # Draw the samples that arrived while the window was minimised as soon as it is shown again
+        self.root.bind("<Map>", self.on_map)
+
+        # Start sampling and updating the GUI
+        self.engine.start()
+        self.backups.start()
         self.update_all()
 
     def create_ui_elements(self):
@@ -105,6 +118,7 @@ class WireReaderApp:
         # Buttons
         buttons = [
             ("Export DB", self.export_db),
+            ("Backup DB", self.backup_db),
             ("Filter", self.open_submenu),
             ("Config", self.configuration_menu),
             ("Exit", self.exit_click)
@@ -128,12 +142,21 @@ class WireReaderApp:
     
         self.data_status = tk.Label(status_frame, text="Data: Not Recording", bg="red", fg="white", padx=5, pady=2)
         self.data_status.pack(side="left", padx=5)
+
+        self.backup_status = tk.Label(status_frame, text="Backup: Idle", bg="grey", fg="white", padx=5, pady=2)
+        self.backup_status.pack(side="left", padx=5)
+
+        # Sampling jitter and overruns of the acquisition thread
+        self.timing_status = tk.Label(status_frame, text="Timing: --", bg="grey", fg="white", padx=5, pady=2)
+        self.timing_status.pack(side="left", padx=5)
     
     def create_live_graph(self):
         self.fig, self.ax = plt.subplots(figsize=(6, 4))
-        self.line, = self.ax.plot([], [], label="Temp1")
-        self.line2, = self.ax.plot([], [], label="Temp2", color='r')
-        self.line3, = self.ax.plot([], [], label="Temp3", color='g')
+        # The lines are animated: full draws leave them out and they are blitted over the cached background
+        self.line, = self.ax.plot([], [], label="Temp1", animated=True)
+        self.line2, = self.ax.plot([], [], label="Temp2", color='r', animated=True)
+        self.line3, = self.ax.plot([], [], label="Temp3", color='g', animated=True)
+        self.lines = [self.line, self.line2, self.line3]
         temp_range = self.config.get("temperature_range")
         self.ax.set_ylim(temp_range[0], temp_range[1])
         self.ax.legend()
@@ -141,69 +164,148 @@ class WireReaderApp:
         self.ax.set_xlabel(f"Last {self.max_points} records")
         self.ax.set_ylabel("Temperature (°C)")
 
+        # Ticks and labels are static, set them once
+        # A handful of ticks whatever graph_points is, fixed steps would mean thousands of ticks on long histories
+        self.ax.xaxis.set_major_locator(MaxNLocator(nbins=10, integer=True))
+        self.ax.xaxis.set_minor_locator(AutoMinorLocator())
+
         # Embed Matplotlib Figure in Tkinter
         self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
         self.canvas_widget = self.canvas.get_tk_widget()
         self.canvas_widget.pack(padx=10, pady=10)
 
+        # Axes, ticks, legend and text are cached after every full draw (first show, resize, new limits)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_graph_draw)
+
+    def on_graph_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for line in self.lines:
+            self.ax.draw_artist(line)
+
     def update_all(self):
-        self.update_variables()
-        if self.inserting_data:
-            db_functions.insert_data_to_db(self.db_path, self.table_name, self.data_time, self.data_temp1, self.data_temp2, self.data_temp3)
+        # One UI frame, every ui_refresh_interval whatever the sampling interval.
+        # Only drains samples published by the acquisition thread, no I/O on the GUI thread
+        # (apart from the one backfill query when graph_points was changed in the config window)
+        if self.config.get("graph_points") != self.max_points:
+            self.set_graph_points(self.config.get("graph_points"))
+        for sample in self.engine.drain():
+            self.update_variables(sample)
+            self.needs_render = True
+        # All samples since the last frame are drawn at once, nothing is drawn while hidden
+        if self.needs_render and self.window_visible():
+            self.render()
+        self.update_backup_status()
+        self.update_timing_status()
+        self.update_job = self.root.after(self.config.get("ui_refresh_interval"), self.update_all)
+
+    def backfill_history(self):
+        # One "latest N rows" query (primary key seek) fills the part of the history that is still empty
+        if len(self.history) >= self.max_points:
+            return
+        try:
+            arrays = db_functions.fetch_last_n_arrays(self.db_path, self.table_name, self.max_points)
+        except Exception as e:
+            print(f"Failed to load the graph history: {e}")
+            return
+        self.history.backfill(arrays["temps"], arrays["time"])
+        self.needs_render = True
+
+    def set_graph_points(self, points):
+        if points < 1:
+            return
+        self.max_points = points
+        # The buffer keeps the newest samples, a larger one is filled from the database
+        self.history.resize(points)
+        self.backfill_history()
+        self.ax.set_xlabel(f"Last {self.max_points} records")
+        self.background = None  # the new label needs a full draw
+        self.needs_render = True
+
+    def render(self):
         self.update_labels()
         self.update_graph()
-        self.update_job = self.root.after(self.config.get("update_interval"), self.update_all)
-
-    def update_variables(self):
-        self.data_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        if self.config.get("debug_mode"):
-            self.data_temp1 = debugf.random_temp()
-            self.data_temp2 = debugf.random_temp()
-            self.data_temp3 = debugf.random_temp()
+        self.needs_render = False
+
+    def window_visible(self):
+        # False while the main window is minimised or withdrawn
+        return self.root.state() not in ("iconic", "withdrawn") and bool(self.root.winfo_viewable())
+
+    def on_map(self, event):
+        # <Map> is also sent for every child widget, only the main window matters
+        if event.widget is self.root and self.needs_render:
+            self.render()
+
+    def update_backup_status(self):
+        if self.backups.running:
+            text, color = f"Backup: {self.backups.progress:.0%}", "orange"
+        elif self.backups.last_error is not None:
+            text, color = "Backup: Failed", "red"
         else:
-            temps = read_1wire_sensors()
-            self.data_temp1 = temps[0]
-            self.data_temp2 = temps[1]
-            self.data_temp3 = temps[2]
-        
-        self.temps1.append(self.data_temp1)
-        self.temps2.append(self.data_temp2)
-        self.temps3.append(self.data_temp3)
+            text, color = "Backup: Idle", "grey"
+        if self.backup_status.cget("text") != text:
+            self.backup_status.config(text=text, bg=color)
+
+    def update_timing_status(self):
+        stats = self.engine.scheduler.stats()
+        text = f"Timing: {stats['max_jitter'] * 1000:.0f} ms max jitter, {stats['overruns']} overruns"
+        if self.timing_status.cget("text") != text:
+            self.timing_status.config(text=text, bg="orange" if stats["overruns"] else "grey")
+
+    def update_variables(self, sample):
+        self.data_time, temps = sample
+        self.data_temp1, self.data_temp2, self.data_temp3 = temps[:3]
+        self.history.append(temps[:3], self.data_time)
         
     def update_labels(self):
         # Update label variables with data values
         self.time_now.set(f"{self.data_time}")
-        self.temp1.set(f"{self.data_temp1}")
-        self.temp2.set(f"{self.data_temp2}")
-        self.temp3.set(f"{self.data_temp3}")
+        readings = [self.data_temp1, self.data_temp2, self.data_temp3]
+        for temp_var, reading in zip([self.temp1, self.temp2, self.temp3], readings):
+            temp_var.set(f"{reading}" if reading is not None else "--")
         
-        # Calculate and update average temperature
-        avg_temp = (self.data_temp1 + self.data_temp2 + self.data_temp3) / 3
-        self.avg_temp.set(f"{avg_temp:.2f} °C")
+        # Calculate and update average temperature (sensors that timed out are skipped)
+        readings = [reading for reading in readings if reading is not None]
+        if readings:
+            avg_temp = sum(readings) / len(readings)
+            self.avg_temp.set(f"{avg_temp:.2f} °C")
+        else:
+            self.avg_temp.set("--")
 
     def update_graph(self):
-        # Plot temperature data vs index (just using len() for index)
-        indices = list(range(len(self.temps1)))  # Create a simple index list for x-axis this is 'time'
+        # Plot temperature data vs index, the x values are a view of a preallocated range
+        indices = self.history.indices()
 
-        # Set data for each plot
-        self.line.set_data(indices, self.temps1)  # Temp1 plot
-        self.line2.set_data(indices, self.temps2)  # Temp2 plot
-        self.line3.set_data(indices, self.temps3)  # Temp3 plot
+        # Set data for each plot, missing readings are NaN and leave a gap in the line
+        for channel, line in enumerate(self.lines):
+            line.set_data(indices, self.history.channel(channel))
 
         # Adjust the x-axis to display a limited number of recent data points
-        self.ax.set_xlim(0, len(self.temps1) + 1)  # Show all available data points, +1 is for slight lead in graph
-
-        # Update x-axis ticks and labels (using the index as labels)
-        self.ax.xaxis.set_major_locator(plt.MultipleLocator(10))  # Major ticks every 10 data points
-        self.ax.xaxis.set_minor_locator(plt.MultipleLocator(5))   # Minor ticks every 5 data points
-        self.ax.set_xlabel(f"Last {self.max_points} records")
-
-        self.canvas.draw()
+        # Sized to the buffer, not to the samples in it, so the limits stay fixed and frames are blitted
+        # while the buffer fills (+1 is for slight lead in graph)
+        xlim = (0, self.history.capacity + 1)
+
+        if self.background is None or self.ax.get_xlim() != xlim:
+            # New limits change the ticks, redraw everything (on_graph_draw caches the new background)
+            self.ax.set_xlim(*xlim)
+            self.canvas.draw()
+        else:
+            # Only the lines changed, paint them over the cached background
+            self.canvas.restore_region(self.background)
+            for line in self.lines:
+                self.ax.draw_artist(line)
+            self.canvas.blit(self.fig.bbox)
 
     def export_db(self):
         print("Export DataBase to csv file")
-        db_functions.export_to_csv(self.db_path, self.table_name, self.config.get("export_path"))
+        db_functions.export_to_csv(self.db_path, self.table_name, self.config.get("export_path"), self.config.get("export_chunk_size"))
+
+    def backup_db(self):
+        # Runs in the background, recording continues
+        if self.backups.run_now():
+            print(f"Backup started, writing to {self.config.get('backup_path')}")
+        else:
+            messagebox.showinfo("Backup", "A backup is already running.")
 
         
     def open_submenu(self):
@@ -214,6 +316,7 @@ class WireReaderApp:
         
     def toggle_insertion(self):
         self.inserting_data = not self.inserting_data
+        self.engine.recording = self.inserting_data
         if self.inserting_data:
             self.toggle_insertion_button.config(text="Stop Recording Data")
             self.data_status.config(text="Data: Recording", bg="green")
@@ -225,7 +328,7 @@ class WireReaderApp:
 
     def check_db_connection(self):
         try:
-            db_functions.create_db(self.db_path, self.table_name)
+            db_functions.create_db(self.db_path, self.table_name, self.config.get("timestamp_storage"))
             self.db_status.config(text="DB: Connected", bg="green")
         except Exception as e:
             print(f"Database connection error: {e}")
@@ -239,6 +342,9 @@ class WireReaderApp:
         print("Exit clicked. Closing the application...")
         if hasattr(self, 'update_job'):
             self.root.after_cancel(self.update_job)
+        self.engine.stop()
+        self.backups.stop()
+        db_functions.close_connections()
         
         # Save configuration before closing
         self.config.save_config()
@@ -252,6 +358,9 @@ class WireReaderApp:
         # Cancel any scheduled after callbacks
         if hasattr(self, 'update_job'):
             self.root.after_cancel(self.update_job)  # Cancel the scheduled update
+        self.engine.stop()
+        self.backups.stop()
+        db_functions.close_connections()
 
         # Close all top-level windows
         for window in self.root.winfo_children():